@@ -1,13 +1,17 @@
 '''
     Module that initializes the Flask application and sets up the logging configuration.
 '''
+import atexit
+import itertools
 import os
 import logging
 import logging.handlers
+import queue
 import time
 from flask import Flask
 from app.data_ingestor import DataIngestor
 from app.task_runner import ThreadPool
+from app.log_handlers import DeferredQueueHandler, JsonFormatter, LifecycleSampler
 
 # Set time zone to UTC
 class UTCFormatter(logging.Formatter):
@@ -28,8 +32,8 @@ webserver = Flask(__name__)
 # Initialize DataIngestor with dataset file
 webserver.data_ingestor = DataIngestor("./nutrition_activity_obesity_usa_subset.csv")
 
-# Initialize job counter for tracking submitted jobs
-webserver.job_counter = 1
+# Allocator of the job ids, next() on it is atomic so it needs no lock
+webserver.job_ids = itertools.count(1)
 
 # Set up logging with RotatingFileHandler
 webserver.log = logging.getLogger(__name__)
@@ -44,17 +48,46 @@ rotating_file_handler = logging.handlers.RotatingFileHandler(
     'webserver.log', maxBytes=300000, backupCount=5
 )
 
-# Log format includes timestamp, module name, log level, and message
-formatter = UTCFormatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S %Z'
-)
+# Log format includes timestamp, module name, log level, and message,
+# as text or, with LOG_FORMAT=json, as one JSON object per line
+if os.getenv("LOG_FORMAT", "text") == "json":
+    formatter = JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%SZ')
+else:
+    formatter = UTCFormatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S %Z'
+    )
 rotating_file_handler.setFormatter(formatter)
 
-# Add handler to logger
-webserver.log.addHandler(rotating_file_handler)
+# Only a LOG_SAMPLE_RATE fraction of the jobs (all by default) log their lifecycle lines
+webserver.log.addFilter(LifecycleSampler(float(os.getenv("LOG_SAMPLE_RATE", "1"))))
+
+# By default the records are queued and written by a background thread, so the
+# request and worker threads never wait for the file. LOG_ASYNC=0 writes them inline.
+webserver.log_listener = None
+if os.getenv("LOG_ASYNC", "1") == "1":
+    log_queue = queue.SimpleQueue()
+    webserver.log_listener = logging.handlers.QueueListener(log_queue, rotating_file_handler)
+    webserver.log.addHandler(DeferredQueueHandler(log_queue))
+else:
+    webserver.log.addHandler(rotating_file_handler)
+
+# Log the memory footprint of the dataset load
+webserver.log.info(
+    "Dataset loaded from %s (compact=%s): %d bytes of data, RSS %d -> %d bytes.",
+    webserver.data_ingestor.memory_report['source'],
+    webserver.data_ingestor.memory_report['compact'],
+    webserver.data_ingestor.memory_report['data_bytes'],
+    webserver.data_ingestor.memory_report['rss_before'],
+    webserver.data_ingestor.memory_report['rss_after'])
 
 # Initialize thread pool for task execution
 webserver.tasks_runner = ThreadPool(webserver.log)
 
+# The listener thread is only started now, after the processes of TP_BACKEND=process
+# are forked, the records logged until then wait in the queue
+if webserver.log_listener is not None:
+    webserver.log_listener.start()
+    atexit.register(webserver.log_listener.stop)
+
 from app import routes
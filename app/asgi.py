@@ -0,0 +1,202 @@
+'''
+    This module exposes the webserver as an ASGI application, for an asyncio server
+    such as uvicorn (see asgi_server.py). The requests are answered by the same
+    Flask routes, but the waits (?wait=<ms> on the job endpoints and on
+    get_results, and the results streams) are awaited on the event loop instead
+    of blocking a server thread, so one process holds many waiting clients.
+'''
+import asyncio
+import json
+from urllib.parse import parse_qs, urlencode
+from werkzeug.test import EnvironBuilder
+from app import webserver
+from app.routes import job_response, encode_response, result_events, MAX_WAIT_MS
+from app.task_runner import JOB_TYPES
+
+# Endpoints that submit a job, and accept ?wait=<ms>
+JOB_PATHS = {f"/api/{name}" for name in JOB_TYPES} | {"/api/batch"}
+
+class AsyncListener: # pylint: disable=too-few-public-methods
+    '''
+        Class that forwards the job_ids finished in the worker threads
+        (see ThreadPool.subscribe) to an asyncio queue of the event loop.
+    '''
+    def __init__(self, loop):
+        '''
+            Function to initialize the listener for the given event loop.
+        '''
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, job_id):
+        '''
+            Function called by the worker threads when a job is finished.
+        '''
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, job_id)
+
+async def wait_for_job(job_id, timeout):
+    '''
+        Function that waits, without blocking the event loop, until the job is
+        finished or the timeout (in seconds) passes.
+    '''
+    listener = AsyncListener(asyncio.get_running_loop())
+    webserver.tasks_runner.subscribe([job_id], listener)
+    try:
+        await asyncio.wait_for(listener.queue.get(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        webserver.tasks_runner.unsubscribe([job_id], listener)
+
+def dispatch(method, path, query, body, headers):
+    '''
+        Function that answers a request with the Flask routes.
+        Returns the status code, the headers and the body of the response.
+    '''
+    builder = EnvironBuilder(path=path, method=method, query_string=urlencode(query, doseq=True),
+                             data=body, headers=headers)
+    with webserver.request_context(builder.get_environ()):
+        response = webserver.full_dispatch_request()
+        return response.status_code, list(response.headers.items()), response.get_data()
+
+async def read_body(receive):
+    '''
+        Function that reads the whole body of the request.
+    '''
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            return body
+
+async def send_response(send, status_code, headers, body):
+    '''
+        Function that sends a complete response.
+    '''
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, status_code, data):
+    '''
+        Function that sends a JSON response.
+    '''
+    await send_response(send, status_code, [('Content-Type', 'application/json')],
+                        encode_response(data))
+
+def wait_seconds(query):
+    '''
+        Function that returns the ?wait=<ms> of the request, in seconds.
+    '''
+    try:
+        return min(int(query.pop('wait', ['0'])[0]), MAX_WAIT_MS) / 1000
+    except ValueError:
+        return 0
+
+async def submit_job(path, query, body, headers, send):
+    '''
+        Function that submits a job through its Flask route, then waits on the
+        event loop for its result if the request asked for it.
+    '''
+    timeout = wait_seconds(query)
+    status_code, response_headers, response_body = await asyncio.to_thread(
+        dispatch, 'POST', path, query, body, headers)
+    if timeout <= 0 or status_code != 200:
+        await send_response(send, status_code, response_headers, response_body)
+        return
+
+    job_id = json.loads(response_body)['job_id']
+    await wait_for_job(job_id, timeout)
+    response, _ = job_response(job_id)
+    if response['status'] == 'done':
+        await send_json(send, 200, {"status": "done", "job_id": job_id, "data": response['data']})
+    else:
+        await send_json(send, 200, {"status": "done", "job_id": job_id})
+
+async def stream_results(query, send):
+    '''
+        Function that streams the results of a set of jobs as Server-Sent Events,
+        with the same events as the stream_results Flask route.
+    '''
+    try:
+        job_ids = [int(job_id) for job_id in query.get('job_ids', [''])[0].split(',') if job_id]
+        timeout = min(int(query.get('timeout', [MAX_WAIT_MS])[0]), MAX_WAIT_MS) / 1000
+    except ValueError:
+        await send_json(send, 400, {"status": "error", "reason": "Invalid job_ids"})
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache')]
+    })
+
+    listener = AsyncListener(asyncio.get_running_loop())
+    steps = result_events(job_ids, timeout, listener)
+    try:
+        step = steps.send(None)
+        while True:
+            if isinstance(step, bytes):
+                await send({'type': 'http.response.body', 'body': step, 'more_body': True})
+                step = steps.send(None)
+                continue
+            try:
+                job_id = await asyncio.wait_for(listener.queue.get(), step)
+            except asyncio.TimeoutError:
+                job_id = None
+            step = steps.send(job_id)
+    except StopIteration:
+        pass
+    finally:
+        steps.close()
+    await send({'type': 'http.response.body', 'body': b''})
+
+async def lifespan(receive, send):
+    '''
+        Function that handles the startup and shutdown messages of the server.
+    '''
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(webserver.tasks_runner.shutdown)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    '''
+        The ASGI application.
+    '''
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    method, path = scope['method'], scope['path']
+    query = parse_qs(scope['query_string'].decode('latin-1'))
+    headers = [(name.decode('latin-1'), value.decode('latin-1'))
+               for name, value in scope['headers']]
+    body = await read_body(receive)
+
+    if method == 'POST' and path in JOB_PATHS:
+        await submit_job(path, query, body, headers, send)
+        return
+
+    if method == 'GET' and path == '/api/stream_results':
+        await stream_results(query, send)
+        return
+
+    if method == 'GET' and path.startswith('/api/get_results/'):
+        timeout = wait_seconds(query)
+        job_id = path.rsplit('/', 1)[-1]
+        if timeout > 0 and job_id.isdigit() and webserver.tasks_runner.jobs.allocated(int(job_id)):
+            await wait_for_job(int(job_id), timeout)
+
+    response = await asyncio.to_thread(dispatch, method, path, query, body, headers)
+    await send_response(send, *response)
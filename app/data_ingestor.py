@@ -2,8 +2,36 @@
     This file contains the DataIngestor class, which is responsible for 
     loading and processing the dataset used in the application.
 """
+import os
+import sys
 from threading import Lock
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from app import snapshot
+
+# Columns that identify the groups the job types aggregate over
+QUESTION = 'Question'
+STATE = 'LocationDesc'
+CATEGORY = 'StratificationCategory1'
+STRATIFICATION = 'Stratification1'
+VALUE = 'Data_Value'
+
+# Repeated string columns, stored as categoricals (integer codes + a lookup of the strings)
+CATEGORICAL_COLUMNS = [QUESTION, STATE, CATEGORY, STRATIFICATION]
+
+def resident_memory():
+    '''
+        Returns the resident set size of the current process in bytes
+    '''
+    try:
+        with open('/proc/self/statm', 'r', encoding='utf-8') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # No procfs, fall back to the peak RSS (kilobytes on Linux, bytes on macOS)
+        import resource # pylint: disable=import-outside-toplevel
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
 
 class MetaSingleton(type):
     """
@@ -22,14 +50,243 @@ class MetaSingleton(type):
                     MetaSingleton, cls).__call__(*args, **kwargs)
             return cls._instances[cls]
 
+def _mean(total, count):
+    '''
+        Returns the mean for a (sum, count) pair, NaN for an empty group
+    '''
+    return total / count if count else float('nan')
+
+def _add(pair, other):
+    '''
+        Returns the sum of two (sum, count) pairs, the first one may be missing
+    '''
+    if pair is None:
+        return other
+    return (pair[0] + other[0], pair[1] + other[1])
+
+def _merge_pairs(pairs, others):
+    '''
+        Returns a new {key: (sum, count)} dictionary adding others to pairs
+    '''
+    merged = dict(pairs)
+    for key, pair in others.items():
+        merged[key] = _add(merged.get(key), pair)
+    return merged
+
+def _codes(column):
+    '''
+        Returns the integer codes of a column and the labels they stand for,
+        the codes of a categorical column being used as they are
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), list(column.cat.categories)
+    codes, labels = pd.factorize(column)
+    return codes, list(labels)
+
+def state_question_sums(data):
+    '''
+        Sum and count of 'Data_Value' for every (state, question) pair, in a single
+        pass over the rows: the two integer codes of a row are flattened into the
+        index of its cell, and all the cells are summed at once with np.bincount.
+        Returns the state labels, the question labels and the two
+        (state x question) arrays.
+    '''
+    state_codes, states = _codes(data[STATE])
+    question_codes, questions = _codes(data[QUESTION])
+    values = data[VALUE].to_numpy(dtype=float)
+
+    # The rows without a value, a state or a question (code -1) are left out
+    kept = ~np.isnan(values) & (state_codes >= 0) & (question_codes >= 0)
+    cells = state_codes[kept].astype(np.int64) * len(questions) + question_codes[kept]
+    shape = (len(states), len(questions))
+    sums = np.bincount(cells, weights=values[kept], minlength=shape[0] * shape[1])
+    counts = np.bincount(cells, minlength=shape[0] * shape[1])
+    return states, questions, sums.reshape(shape), counts.reshape(shape)
+
+def _align_categories(column, reference):
+    '''
+        Returns the categorical column with categories of the same dtype as the
+        reference's, as union_categoricals requires. A column without any value
+        is read with categories of another dtype.
+    '''
+    categories = column.cat.categories.astype(reference.cat.categories.dtype)
+    return column.cat.set_categories(categories)
+
+class AggregateIndex:
+    """
+        Precomputed sum/count aggregates of 'Data_Value', built once per dataset.
+        Every level is keyed by question first, so any job type only has to
+        look up its question and turn the stored (sum, count) pairs into means.
+    """
+    def __init__(self):
+        # question -> (sum, count)
+        self.by_question = {}
+        # question -> {state: (sum, count)}
+        self.by_state = {}
+        # question -> {state: {(category, stratification): (sum, count)}}
+        self.by_state_category = {}
+        # question -> {(category, stratification): (sum, count)}
+        self.by_category = {}
+
+    @classmethod
+    def from_frame(cls, data):
+        '''
+            Builds the index with one groupby pass per aggregation level
+        '''
+        index = cls()
+        for key, pair in cls._group(data, [QUESTION]).items():
+            index.by_question[key[0]] = pair
+        for key, pair in cls._group(data, [QUESTION, STATE]).items():
+            index.by_state.setdefault(key[0], {})[key[1]] = pair
+        for key, pair in cls._group(data, [QUESTION, STATE, CATEGORY, STRATIFICATION]).items():
+            index.by_state_category.setdefault(key[0], {}).setdefault(key[1], {})[key[2:]] = pair
+        for key, pair in cls._group(data, [QUESTION, CATEGORY, STRATIFICATION]).items():
+            index.by_category.setdefault(key[0], {})[key[1:]] = pair
+        return index
+
+    def merge(self, other):
+        '''
+            Returns a new index holding the aggregates of both indexes. Only the
+            levels of the questions in other are copied, the others are shared,
+            and self is left unchanged for the readers still using it.
+        '''
+        index = AggregateIndex()
+        index.by_question = dict(self.by_question)
+        index.by_state = dict(self.by_state)
+        index.by_state_category = dict(self.by_state_category)
+        index.by_category = dict(self.by_category)
+
+        for question, pair in other.by_question.items():
+            index.by_question[question] = _add(self.by_question.get(question), pair)
+        for question, states in other.by_state.items():
+            index.by_state[question] = _merge_pairs(self.by_state.get(question, {}), states)
+        for question, states in other.by_state_category.items():
+            merged = dict(self.by_state_category.get(question, {}))
+            for state, groups in states.items():
+                merged[state] = _merge_pairs(merged.get(state, {}), groups)
+            index.by_state_category[question] = merged
+        for question, groups in other.by_category.items():
+            index.by_category[question] = _merge_pairs(self.by_category.get(question, {}), groups)
+        return index
+
+    @staticmethod
+    def _group(data, keys):
+        '''
+            Returns {group key tuple: (sum, count)} of 'Data_Value' for the given keys
+        '''
+        grouped = data.groupby(keys, observed=True)[VALUE].agg(['sum', 'count'])
+        groups = grouped.index.tolist()
+        if len(keys) == 1:
+            groups = [(group,) for group in groups]
+        return dict(zip(groups, zip(grouped['sum'].tolist(), grouped['count'].tolist())))
+
+    def question_mean(self, question):
+        '''
+            Mean of 'Data_Value' over all the rows of the question
+        '''
+        return _mean(*self.by_question.get(question, (0.0, 0)))
+
+    def state_means(self, question):
+        '''
+            Mean of 'Data_Value' for every state, ordered by state name
+        '''
+        return {state: _mean(*pair)
+                for state, pair in self.by_state.get(question, {}).items()}
+
+    def state_mean(self, question, state):
+        '''
+            Mean of 'Data_Value' for a single state
+        '''
+        return _mean(*self.by_state.get(question, {}).get(state, (0.0, 0)))
+
+    def stratification_state_means(self, question, category, stratification):
+        '''
+            Mean of 'Data_Value' for every state having values in one
+            (category, stratification) group
+        '''
+        key = (category, stratification)
+        return {state: _mean(*groups[key])
+                for state, groups in self.by_state_category.get(question, {}).items()
+                if groups.get(key, (0.0, 0))[1]}
+
+    def state_question_sums(self):
+        '''
+            Sum and count of 'Data_Value' for every (state, question) pair, as
+            state_question_sums returns them for the rows
+        '''
+        questions = list(self.by_state)
+        states = sorted({state for pairs in self.by_state.values() for state in pairs})
+        positions = {state: i for i, state in enumerate(states)}
+        sums = np.zeros((len(states), len(questions)))
+        counts = np.zeros((len(states), len(questions)), dtype=np.int64)
+        for column, question in enumerate(questions):
+            for state, (total, count) in self.by_state[question].items():
+                sums[positions[state], column] = total
+                counts[positions[state], column] = count
+        return states, questions, sums, counts
+
+    def state_category_means(self, question):
+        '''
+            Mean of 'Data_Value' for every (state, category, stratification) group
+        '''
+        return {(state, *key): _mean(*pair)
+                for state, groups in self.by_state_category.get(question, {}).items()
+                for key, pair in groups.items()}
+
+    def category_means(self, question, state=None):
+        '''
+            Mean of 'Data_Value' for every (category, stratification) group,
+            either over all the states or restricted to a single one
+        '''
+        if state is None:
+            return {key: _mean(*pair)
+                    for key, pair in self.by_category.get(question, {}).items()}
+        return {key: _mean(*pair)
+                for key, pair in self.by_state_category.get(question, {}).get(state, {}).items()}
+
+class DatasetVersion: # pylint: disable=too-few-public-methods
+    """
+        One version of the dataset: its rows, their aggregates and its number.
+        A version is never modified, appending rows publishes a new one, so a
+        task that took a version computes its whole result from it.
+    """
+    def __init__(self, version, data, aggregates, questions_best_is_min):
+        self.version = version
+        self.data = data
+        self.aggregates = aggregates
+        self.questions_best_is_min = questions_best_is_min
+
 class DataIngestor(metaclass=MetaSingleton): # pylint: disable=too-few-public-methods
     """
         This class handles the ingestion and processing of the dataset.
         It loads data from a CSV file and provides methods for filtering
         and aggregating the information.
     """
-    def __init__(self, csv_path: str):
-        self.data = pd.read_csv(csv_path)
+    def __init__(self, csv_path: str, compact: bool = None):
+        if compact is None:
+            compact = os.getenv("DI_COMPACT", "1") == "1"
+
+        self.compact = compact
+        # With DI_STREAMING=1 only the aggregates are kept, not the rows
+        self.streaming = os.getenv("DI_STREAMING", "0") == "1"
+
+        rss_before = resident_memory()
+        aggregates = None
+        if self.streaming:
+            (aggregates, _), data, source = self.read_streaming(csv_path), None, 'stream'
+        elif compact:
+            data, source = self.load_compact(csv_path)
+        else:
+            data, source = pd.read_csv(csv_path), 'csv'
+
+        # Memory footprint of the load, logged by the application at startup
+        self.memory_report = {
+            'compact': compact,
+            'source': source,
+            'rss_before': rss_before,
+            'rss_after': resident_memory(),
+            'data_bytes': int(data.memory_usage(deep=True).sum()) if data is not None else 0
+        }
 
         self.questions_best_is_min = [
             'Percent of adults aged 18 years and older who have an overweight classification',
@@ -53,3 +310,136 @@ class DataIngestor(metaclass=MetaSingleton): # pylint: disable=too-few-public-me
             'Percent of adults who engage in muscle-strengthening activities on 2 or more ' +
             'days a week',
         ]
+
+        # Current version of the dataset, with the aggregates used to answer
+        # every job type without scanning the data. Replaced, never modified.
+        if aggregates is None:
+            aggregates = AggregateIndex.from_frame(data)
+        self.dataset = DatasetVersion(1, data, aggregates, self.questions_best_is_min)
+
+        # Serializes the appends, the readers never wait
+        self.append_lock = Lock()
+
+    @property
+    def version(self):
+        '''
+            Version of the data, results computed for another version are stale
+        '''
+        return self.dataset.version
+
+    @property
+    def data(self):
+        '''
+            Rows of the current version of the dataset, None when streaming
+        '''
+        return self.dataset.data
+
+    @property
+    def aggregates(self):
+        '''
+            Aggregates of the current version of the dataset
+        '''
+        return self.dataset.aggregates
+
+    def append(self, csv_source):
+        '''
+            Adds the rows of a CSV chunk (a path or a file object, with the header
+            of the dataset) and publishes them as a new version. Only the new rows
+            are parsed and aggregated, their aggregates are merged into a copy of
+            the current ones. Returns the new version and the number of added rows.
+        '''
+        if self.streaming:
+            aggregates, rows = self.read_streaming(csv_source)
+            with self.append_lock:
+                current = self.dataset
+                # An empty chunk doesn't publish a new version
+                if rows == 0:
+                    return current.version, 0
+                self.dataset = DatasetVersion(
+                    current.version + 1, None, current.aggregates.merge(aggregates),
+                    self.questions_best_is_min)
+                return self.dataset.version, rows
+
+        if self.compact:
+            chunk = self.read_compact(csv_source)
+        else:
+            chunk = pd.read_csv(csv_source)
+
+        with self.append_lock:
+            current = self.dataset
+            if chunk.empty:
+                return current.version, 0
+            if self.compact:
+                # The categories of the new rows are added after the existing ones,
+                # so the codes of the existing rows stay valid
+                data = pd.DataFrame({
+                    column: union_categoricals([
+                        current.data[column],
+                        _align_categories(chunk[column], current.data[column])])
+                    if column in CATEGORICAL_COLUMNS
+                    else pd.concat([current.data[column], chunk[column]], ignore_index=True)
+                    for column in current.data.columns
+                })
+            else:
+                data = pd.concat([current.data, chunk], ignore_index=True)
+            aggregates = current.aggregates.merge(AggregateIndex.from_frame(chunk))
+
+            # A single assignment, the readers see either version but never a mix
+            self.dataset = DatasetVersion(
+                current.version + 1, data, aggregates, self.questions_best_is_min)
+            return self.dataset.version, len(chunk)
+
+    def load_compact(self, csv_path):
+        '''
+            Opens the memory mapped snapshot of the CSV if it is up to date, otherwise
+            parses the CSV and writes the snapshot for the next start (DI_SNAPSHOT=0
+            disables snapshots). Returns the data and where it was loaded from.
+        '''
+        if os.getenv("DI_SNAPSHOT", "1") != "1":
+            return self.read_compact(csv_path), 'csv'
+
+        snapshot_dir = snapshot.snapshot_dir_for(csv_path)
+        fingerprint = snapshot.source_fingerprint(
+            csv_path, os.getenv("DI_VALUE_DTYPE", "float64"))
+        data = snapshot.read_snapshot(snapshot_dir, fingerprint)
+        if data is not None:
+            return data, 'snapshot'
+
+        data = self.read_compact(csv_path)
+        try:
+            snapshot.write_snapshot(data, snapshot_dir, fingerprint)
+        except OSError:
+            # A read-only location only costs the snapshot, the data is already loaded
+            pass
+        return data, 'csv'
+
+    @staticmethod
+    def read_compact(csv_path):
+        '''
+            Reads only the columns used by the job types, with the repeated strings
+            stored as categoricals and 'Data_Value' as a float array
+            (DI_VALUE_DTYPE, float64 by default).
+        '''
+        dtypes = {column: 'category' for column in CATEGORICAL_COLUMNS}
+        dtypes[VALUE] = os.getenv("DI_VALUE_DTYPE", "float64")
+        return pd.read_csv(csv_path, usecols=CATEGORICAL_COLUMNS + [VALUE], dtype=dtypes)
+
+    @staticmethod
+    def read_streaming(csv_source):
+        '''
+            Reads the CSV in chunks of DI_CHUNK_ROWS rows (100000 by default) and
+            returns only their aggregates and the number of rows read, so the memory
+            used depends on the number of groups and not on the number of rows.
+            Every job type is answered from the (sum, count) pairs, nothing else
+            has to be kept.
+        '''
+        dtypes = {column: 'category' for column in CATEGORICAL_COLUMNS}
+        dtypes[VALUE] = os.getenv("DI_VALUE_DTYPE", "float64")
+        aggregates = AggregateIndex()
+        rows = 0
+        with pd.read_csv(csv_source, usecols=CATEGORICAL_COLUMNS + [VALUE], dtype=dtypes,
+                         chunksize=int(os.getenv("DI_CHUNK_ROWS", "100000"))) as reader:
+            for chunk in reader:
+                aggregates = aggregates.merge(AggregateIndex.from_frame(chunk))
+                rows += len(chunk)
+        return aggregates, rows
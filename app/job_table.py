@@ -0,0 +1,141 @@
+'''
+    This module implements the table of the job statuses.
+'''
+from array import array
+from threading import Lock
+
+# Status codes stored in the table, a job is running until it is finished
+RUNNING = 0
+STATUSES = (None, 'completed', 'failed', 'shed', 'rejected', 'evicted')
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+EVICTED = STATUS_CODES['evicted']
+
+class JobTable:
+    '''
+        Class that keeps the status of every job as one byte in an array indexed
+        by job_id. With a retention, only the last retention job_ids are kept:
+        older finished jobs are evicted (the caller removes their results)
+        and report the 'evicted' status. The number of unfinished jobs is counted
+        as they are registered and finished.
+    '''
+    def __init__(self, retention=0):
+        '''
+            Function to initialize an empty table. A retention of 0 keeps every job.
+        '''
+        self.lock = Lock()
+        self.statuses = array('B')
+        # job_id of statuses[0], the jobs before it are evicted
+        self.base = 1
+        self.retention = retention
+        self.running = 0
+
+    def register(self, job_id):
+        '''
+            Function that adds an unfinished job.
+        '''
+        with self.lock:
+            self.slot(job_id)
+            self.running += 1
+
+    def slot(self, job_id):
+        '''
+            Function that returns the index of a job in the array, growing it
+            if needed. Must be called with the lock held.
+        '''
+        index = job_id - self.base
+        if index >= len(self.statuses):
+            self.statuses.extend(bytes(index + 1 - len(self.statuses)))
+        return index
+
+    def finish(self, job_ids, status):
+        '''
+            Function that sets the final status of jobs, then evicts the finished
+            jobs that fell out of the retention window. Returns the evicted job_ids.
+        '''
+        code = STATUS_CODES[status]
+        with self.lock:
+            for job_id in job_ids:
+                if job_id < self.base:
+                    continue
+                index = self.slot(job_id)
+                if self.statuses[index] == RUNNING:
+                    self.running -= 1
+                self.statuses[index] = code
+            return self.evict()
+
+    def evict(self):
+        '''
+            Function that removes the finished jobs older than the retention window,
+            stopping at the oldest unfinished one. They are removed in batches of
+            an eighth of the window, so the array is shifted once per batch.
+            Must be called with the lock held. Returns the evicted job_ids.
+        '''
+        if not self.retention or len(self.statuses) <= self.retention + self.retention // 8:
+            return []
+
+        count = 0
+        excess = len(self.statuses) - self.retention
+        while count < excess and self.statuses[count] != RUNNING:
+            count += 1
+        del self.statuses[:count]
+        self.base += count
+        return range(self.base - count, self.base)
+
+    def status(self, job_id):
+        '''
+            Function that returns the status of a job, None while it is running.
+        '''
+        with self.lock:
+            if job_id < self.base:
+                return STATUSES[EVICTED]
+            index = job_id - self.base
+            return STATUSES[self.statuses[index]] if index < len(self.statuses) else None
+
+    def is_finished(self, job_id):
+        '''
+            Function that returns whether a job is finished.
+        '''
+        return self.status(job_id) is not None
+
+    def jobs(self, end, start=1, statuses=None, limit=None):
+        '''
+            Function that returns (job_id, status) pairs for the job_ids from start
+            to end (excluded), only the ones whose status is in statuses if given
+            (None for the running ones), and at most limit of them. The evicted jobs
+            are only listed when their status is requested.
+        '''
+        jobs = []
+        with self.lock:
+            start = max(start, 1)
+            if statuses is None or STATUSES[EVICTED] not in statuses:
+                start = max(start, self.base)
+            for job_id in range(start, end):
+                if limit is not None and len(jobs) >= limit:
+                    break
+                index = job_id - self.base
+                if index < 0:
+                    code = EVICTED
+                else:
+                    code = self.statuses[index] if index < len(self.statuses) else RUNNING
+                if statuses is None or STATUSES[code] in statuses:
+                    jobs.append((job_id, STATUSES[code]))
+        return jobs
+
+    def end(self):
+        '''
+            Function that returns the job_id after the last registered one.
+        '''
+        with self.lock:
+            return self.base + len(self.statuses)
+
+    def allocated(self, job_id):
+        '''
+            Function that returns whether a job_id was ever registered.
+        '''
+        return 1 <= job_id < self.end()
+
+    def num_running(self):
+        '''
+            Function that returns the number of unfinished jobs.
+        '''
+        return self.running
@@ -0,0 +1,64 @@
+'''
+    This module implements the logging handlers, filters and formatters of the webserver.
+'''
+import json
+import logging
+import logging.handlers
+import time
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    '''
+        Class that queues the records as they are, for a QueueListener of the
+        same process. The message is only formatted by the listener thread, so
+        the logging threads never format, nor wait for the disk.
+    '''
+    def prepare(self, record):
+        '''
+            Function that returns the record to queue, left unformatted.
+        '''
+        return record
+
+class LifecycleSampler(logging.Filter): # pylint: disable=too-few-public-methods
+    '''
+        Class that keeps the INFO lines of the jobs (the records with a job_id)
+        for a sample of the jobs only. A sampled job keeps all of its lines,
+        warnings and errors are always kept.
+    '''
+    def __init__(self, rate):
+        '''
+            Function to initialize the filter with the fraction of jobs to keep.
+        '''
+        super().__init__()
+        self.threshold = int(rate * 2 ** 32)
+
+    def filter(self, record):
+        '''
+            Function that returns whether the record is kept.
+        '''
+        job_id = getattr(record, 'job_id', None)
+        if job_id is None or record.levelno > logging.INFO:
+            return True
+        # Multiplicative hash, so consecutive job_ids are spread over the sample
+        return (job_id * 2654435761) % 2 ** 32 < self.threshold
+
+class JsonFormatter(logging.Formatter):
+    '''
+        Class that formats every record as one JSON object, with UTC timestamps.
+    '''
+    converter = time.gmtime
+
+    def format(self, record):
+        '''
+            Function that returns the JSON line of a record.
+        '''
+        line = {
+            "time": self.formatTime(record, self.datefmt),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage()
+        }
+        if getattr(record, 'job_id', None) is not None:
+            line["job_id"] = record.job_id
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False)
@@ -0,0 +1,152 @@
+'''
+    This module implements the metrics exposed in the Prometheus text format.
+'''
+from bisect import bisect_left
+from threading import Lock, current_thread, local
+import weakref
+
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HISTOGRAMS = {
+    'task_queue_wait_seconds': 'Time between the enqueue and the start of a task',
+    'task_compute_seconds': 'Time spent computing the result of a task',
+    'task_result_write_seconds': 'Time spent storing the result of a task',
+    'task_latency_seconds': 'Time between the enqueue and the completion of a task',
+}
+
+COUNTERS = {
+    'tasks_completed_total': 'Tasks completed',
+    'tasks_failed_total': 'Tasks that raised an error',
+    'result_fetches_total': 'Results fetched, by the status of the job',
+}
+
+def format_labels(labels):
+    '''
+        Function that formats a tuple of (name, value) label pairs.
+    '''
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+class Metrics:
+    '''
+        Class that records latency histograms and counters. Every thread records
+        into its own shard, so recording takes no lock; the shards are only
+        merged when the metrics are rendered. The shard of a thread that ended
+        is folded into the retired totals, so the short lived request threads
+        don't accumulate shards.
+    '''
+    def __init__(self, enabled=True):
+        '''
+            Function to initialize the metrics, recording nothing if disabled.
+        '''
+        self.enabled = enabled
+        self.local = local()
+        self.shards = []
+        self.shards_lock = Lock()
+        # Histograms and counters of the threads that ended
+        self.retired = ({}, {})
+
+    def shard(self):
+        '''
+            Function that returns the shard of the current thread.
+        '''
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = ({}, {})
+            with self.shards_lock:
+                self.shards.append(shard)
+            weakref.finalize(current_thread(), self.retire, shard)
+        return shard
+
+    def retire(self, shard):
+        '''
+            Function that folds the shard of an ended thread into the retired totals.
+        '''
+        with self.shards_lock:
+            self.shards.remove(shard)
+            self.fold(self.retired, shard)
+
+    @staticmethod
+    def fold(total, shard):
+        '''
+            Function that adds the histograms and counters of a shard to the given totals.
+        '''
+        histograms, counters = total
+        for key, entry in list(shard[0].items()):
+            merged = histograms.setdefault(key, [0] * len(entry))
+            for i, value in enumerate(entry):
+                merged[i] += value
+        for key, value in list(shard[1].items()):
+            counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        '''
+            Function that records a duration in a histogram.
+        '''
+        if not self.enabled:
+            return
+        histograms = self.shard()[0]
+        entry = histograms.get((name, labels))
+        if entry is None:
+            # One count per bucket, then the +Inf bucket, the sum and the count
+            entry = histograms[(name, labels)] = [0] * (len(BUCKETS) + 1) + [0.0, 0]
+        entry[bisect_left(BUCKETS, seconds)] += 1
+        entry[-2] += seconds
+        entry[-1] += 1
+
+    def increment(self, name, labels, amount=1):
+        '''
+            Function that increments a counter.
+        '''
+        if not self.enabled:
+            return
+        counters = self.shard()[1]
+        counters[(name, labels)] = counters.get((name, labels), 0) + amount
+
+    def merged(self):
+        '''
+            Function that merges the shards of all the threads.
+        '''
+        total = ({}, {})
+        # The lock keeps the shards from being retired while they are merged
+        with self.shards_lock:
+            self.fold(total, self.retired)
+            for shard in self.shards:
+                self.fold(total, shard)
+        return total
+
+    def render(self, gauges):
+        '''
+            Function that renders the metrics, and the given gauges
+            ({name: (help, value)}), in the Prometheus text format.
+        '''
+        histograms, counters = self.merged()
+        lines = []
+
+        for name, description in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), entry in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), entry):
+                    cumulative += count
+                    bucket_labels = format_labels(labels + (('le', bound),))
+                    lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+                lines.append(f"{name}_sum{{{format_labels(labels)}}} {entry[-2]}")
+                lines.append(f"{name}_count{{{format_labels(labels)}}} {entry[-1]}")
+
+        for name, description in COUNTERS.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{{{format_labels(labels)}}} {value}")
+
+        for name, (description, value) in gauges.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,207 @@
+'''
+    This module implements the process execution backend (TP_BACKEND=process).
+    The columns of the dataset are copied once into shared memory blocks and the
+    worker processes attach to them, so the dataset is neither copied nor pickled
+    per task and the TaskProcessor work runs outside of the server's GIL.
+    When rows are appended, the new version of the dataset is published in new
+    blocks, and the workers switch to it with the first task that needs it.
+    The aggregates merged by the server are published along with the columns,
+    in streaming mode (DI_STREAMING=1) there are no rows, only them.
+'''
+from multiprocessing import get_context, shared_memory
+import pickle
+from threading import Lock
+import numpy as np
+import pandas as pd
+from app.data_ingestor import CATEGORICAL_COLUMNS, VALUE
+
+# Dataset attached by the initializer of every worker process
+_WORKER_DATASET = None
+
+class SharedDataset: # pylint: disable=too-few-public-methods
+    '''
+        Class that publishes the columns of a version of the compact dataset in
+        shared memory. The categorical columns are stored as their integer codes,
+        their categories travel in the picklable spec.
+    '''
+    def __init__(self, dataset):
+        '''
+            Function that copies the columns into new shared memory blocks.
+        '''
+        self.blocks = []
+        self.spec = {
+            'version': dataset.version,
+            'questions_best_is_min': dataset.questions_best_is_min,
+            'columns': {}
+        }
+
+        # Tasks using the blocks, they are released once retired and unused
+        self.users = 0
+        self.retired = False
+
+        # Pickled once here, unpickled once per worker and version, rather than
+        # rebuilt from the rows by every worker
+        payload = pickle.dumps(dataset.aggregates, protocol=pickle.HIGHEST_PROTOCOL)
+        block = shared_memory.SharedMemory(create=True, size=len(payload))
+        block.buf[:len(payload)] = payload
+        self.blocks.append(block)
+        self.spec['aggregates'] = {'name': block.name, 'size': len(payload)}
+
+        if dataset.data is None:
+            return
+
+        for column in CATEGORICAL_COLUMNS + [VALUE]:
+            series = dataset.data[column]
+            column_spec = {}
+            if column in CATEGORICAL_COLUMNS:
+                # Also covers a dataset loaded with DI_COMPACT=0
+                series = series.astype('category')
+                values = series.cat.codes.to_numpy()
+                column_spec['categories'] = series.cat.categories.tolist()
+            else:
+                values = series.to_numpy()
+
+            block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+            self.blocks.append(block)
+
+            column_spec.update(name=block.name, dtype=values.dtype.str, length=len(values))
+            self.spec['columns'][column] = column_spec
+
+    def close(self):
+        '''
+            Function that releases the shared memory blocks.
+        '''
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+class SharedDatasetView: # pylint: disable=too-few-public-methods
+    '''
+        Class that attaches a worker process to a SharedDataset and exposes
+        the same attributes as the DataIngestor to the TaskProcessor.
+    '''
+    def __init__(self, spec):
+        '''
+            Function that wraps the shared memory blocks without copying them.
+        '''
+        self.version = spec['version']
+        self.questions_best_is_min = spec['questions_best_is_min']
+        self.blocks = []
+
+        block = shared_memory.SharedMemory(name=spec['aggregates']['name'])
+        self.aggregates = pickle.loads(block.buf[:spec['aggregates']['size']])
+        block.close()
+
+        if not spec['columns']:
+            self.data = None
+            return
+
+        columns = {}
+        for column, column_spec in spec['columns'].items():
+            block = shared_memory.SharedMemory(name=column_spec['name'])
+            self.blocks.append(block)
+            values = np.ndarray(
+                (column_spec['length'],), dtype=column_spec['dtype'], buffer=block.buf)
+            if 'categories' in column_spec:
+                values = pd.Categorical.from_codes(
+                    values, categories=column_spec['categories'], validate=False)
+            columns[column] = pd.Series(values, copy=False)
+
+        self.data = pd.DataFrame(columns, copy=False)
+
+    def close(self):
+        '''
+            Function that detaches the worker from the shared memory blocks.
+        '''
+        # The arrays viewing the blocks must be gone before they can be closed
+        self.data = None
+        for block in self.blocks:
+            try:
+                block.close()
+            except BufferError:
+                # Still referenced, the mapping goes away with the last reference
+                pass
+        self.blocks = []
+
+def _init_worker(spec):
+    '''
+        Initializer of the worker processes.
+    '''
+    global _WORKER_DATASET # pylint: disable=global-statement
+    _WORKER_DATASET = SharedDatasetView(spec)
+
+def _compute_result(task, spec):
+    '''
+        Function that computes a task in a worker process, attaching it first
+        to the version of the dataset the task was submitted with.
+    '''
+    global _WORKER_DATASET # pylint: disable=global-statement
+    if _WORKER_DATASET.version != spec['version']:
+        _WORKER_DATASET.close()
+        _WORKER_DATASET = SharedDatasetView(spec)
+
+    # Imported here, the task_runner module imports this one
+    from app.task_runner import TaskProcessor # pylint: disable=import-outside-toplevel
+    return TaskProcessor(_WORKER_DATASET).compute_result(task)
+
+class ProcessBackend:
+    '''
+        Class that computes the tasks in a pool of worker processes attached to
+        the dataset in shared memory. The TaskRunner threads keep handling the
+        job_ids, statuses and results, only the computation is moved.
+    '''
+    def __init__(self, dataset, num_processes):
+        '''
+            Function that publishes the dataset and starts the worker processes.
+        '''
+        self.dataset = SharedDataset(dataset)
+        self.lock = Lock()
+        # The workers are forked right away, before the server threads exist.
+        # Spawned processes would re-import, and re-initialize, the whole application.
+        self.pool = get_context('fork').Pool(
+            num_processes, initializer=_init_worker, initargs=(self.dataset.spec,))
+
+    def compute_result(self, task, dataset):
+        '''
+            Function that computes a task on the given version of the dataset
+            in one of the worker processes.
+        '''
+        shared = self.acquire(dataset)
+        try:
+            return self.pool.apply(_compute_result, (task, shared.spec))
+        finally:
+            self.release(shared)
+
+    def acquire(self, dataset):
+        '''
+            Function that returns the shared copy of the current version of the
+            dataset, publishing it first if the given version is newer.
+        '''
+        with self.lock:
+            if dataset.version > self.dataset.spec['version']:
+                retired = self.dataset
+                self.dataset = SharedDataset(dataset)
+                retired.retired = True
+                if retired.users == 0:
+                    retired.close()
+            self.dataset.users += 1
+            return self.dataset
+
+    def release(self, shared):
+        '''
+            Function that releases a shared dataset returned by acquire.
+        '''
+        with self.lock:
+            shared.users -= 1
+            if shared.retired and shared.users == 0:
+                shared.close()
+
+    def shutdown(self):
+        '''
+            Function that stops the worker processes and releases the shared memory.
+        '''
+        self.pool.close()
+        self.pool.join()
+        self.dataset.close()
@@ -0,0 +1,146 @@
+'''
+    This module implements the on-demand profiling of the task computations.
+'''
+from contextlib import contextmanager
+from threading import Lock
+import cProfile
+import io
+import os
+import pstats
+import random
+import time
+
+# Orders accepted by report, as by pstats.Stats.sort_stats
+SORT_KEYS = frozenset(pstats.Stats.sort_arg_dict_default)
+
+class JobProfiler: # pylint: disable=too-many-instance-attributes
+    '''
+        Class that runs cProfile around the tasks selected by the admin and
+        aggregates their stats. The tasks to profile are chosen by job type
+        (or all of them), then either the next N ones or a random sample.
+        cProfile can't profile two threads at once, so a task selected while
+        another one is being profiled runs without the profiler.
+        With the process backend, only the dispatch to the worker is visible.
+    '''
+    def __init__(self):
+        '''
+            Function to initialize a disabled profiler.
+        '''
+        self.lock = Lock()
+        self.run_lock = Lock()
+        self.active = False
+        self.job_type = None
+        self.sample_rate = 0.0
+        self.remaining = 0
+        self.stats = None
+        self.profiled = 0
+
+    def configure(self, job_type=None, sample_rate=0.0, next_jobs=0):
+        '''
+            Function that starts profiling, for the given job type (None for all),
+            the next next_jobs tasks, then a sample_rate fraction of them.
+            The stats aggregated so far are dropped.
+        '''
+        with self.lock:
+            self.job_type = job_type
+            self.sample_rate = sample_rate
+            self.remaining = next_jobs
+            self.active = next_jobs > 0 or sample_rate > 0
+            self.stats = None
+            self.profiled = 0
+
+    def stop(self):
+        '''
+            Function that stops profiling, keeping the aggregated stats.
+        '''
+        with self.lock:
+            self.active = False
+
+    def should_profile(self, job_type):
+        '''
+            Function that decides whether a task of the given job type is profiled,
+            counting the profiled tasks.
+        '''
+        # Cheap check first, the profiler is disabled most of the time
+        if not self.active:
+            return False
+        with self.lock:
+            if not self.active or self.job_type not in (None, job_type):
+                return False
+            if self.remaining > 0:
+                self.remaining -= 1
+                self.active = self.remaining > 0 or self.sample_rate > 0
+            elif random.random() >= self.sample_rate:
+                return False
+            self.profiled += 1
+            return True
+
+    def run(self, profiled, function, *args):
+        '''
+            Function that calls function(*args), under cProfile if profiled.
+        '''
+        if not profiled:
+            return function(*args)
+        with self.exclusive() as acquired:
+            if not acquired:
+                return function(*args)
+            profile = cProfile.Profile()
+            result = profile.runcall(function, *args)
+
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+        return result
+
+    @contextmanager
+    def exclusive(self):
+        '''
+            Context manager that yields whether the calling thread got the profiler,
+            without waiting for it, and releases it at the end.
+        '''
+        acquired = self.run_lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.run_lock.release()
+
+    def report(self, sort='cumulative', limit=40):
+        '''
+            Function that returns the aggregated stats as text.
+        '''
+        with self.lock:
+            if self.stats is None:
+                return ""
+            output = io.StringIO()
+            self.stats.stream = output
+            self.stats.sort_stats(sort).print_stats(limit)
+            return output.getvalue()
+
+    def dump(self, directory='./profiles'):
+        '''
+            Function that writes the aggregated stats to a pstats file
+            and returns its path, or None if nothing was profiled.
+        '''
+        with self.lock:
+            if self.stats is None:
+                return None
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"profile-{int(time.time())}.pstats")
+            self.stats.dump_stats(path)
+            return path
+
+    def status(self):
+        '''
+            Function that returns the configuration and progress of the profiler.
+        '''
+        with self.lock:
+            return {
+                "active": self.active,
+                "job_type": self.job_type,
+                "sample_rate": self.sample_rate,
+                "remaining": self.remaining,
+                "profiled_jobs": self.profiled
+            }
@@ -0,0 +1,99 @@
+'''
+    This module implements the LRU cache of task results shared by all the task runners.
+'''
+from collections import OrderedDict
+from threading import Lock
+import sys
+
+def estimate_size(value):
+    '''
+        Function that estimates the memory used by a result, in bytes.
+    '''
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(key) + estimate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+class ResultCache: # pylint: disable=too-many-instance-attributes
+    '''
+        Class that implements a thread-safe, memory-bounded LRU cache of results.
+        The cache belongs to one version of the dataset and empties itself
+        as soon as it is used with another version.
+    '''
+    def __init__(self, max_bytes):
+        '''
+            Function to initialize the cache with its memory budget.
+        '''
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.version = None
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        # Counters exposed by the cache_stats endpoint
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        '''
+            Function that returns the cached result for the key, or None.
+        '''
+        with self.lock:
+            entry = self.entries.get(key) if self.check_version(version) else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result, version):
+        '''
+            Function that caches a result, evicting the least recently used ones
+            until the cache fits its memory budget again.
+        '''
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if not self.check_version(version):
+                return
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (result, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def check_version(self, version):
+        '''
+            Function that drops every entry if the dataset moved to a newer version.
+            Returns False for an older version, whose results must not be cached.
+            Must be called with the lock held.
+        '''
+        if self.version is None or version > self.version:
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+        return version == self.version
+
+    def stats(self):
+        '''
+            Function that returns the counters of the cache.
+        '''
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "size_bytes": self.size,
+                "max_bytes": self.max_bytes
+            }
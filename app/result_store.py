@@ -0,0 +1,204 @@
+'''
+    This module implements the stores that keep the results of the finished jobs.
+'''
+from collections import OrderedDict
+from threading import Lock
+import json
+import math
+import os
+import time
+
+# orjson encodes several times faster, when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def non_finite(value):
+    '''
+        Function that returns whether a result holds a NaN or infinite float.
+    '''
+    if isinstance(value, float):
+        return not math.isfinite(value)
+    if isinstance(value, dict):
+        return any(non_finite(item) for item in value.values())
+    if isinstance(value, list):
+        return any(non_finite(item) for item in value)
+    return False
+
+class ResultStore:
+    '''
+        Base class of the result stores, mapping a job_id to its result.
+        The results are stored encoded, as compact JSON bytes, so they are
+        encoded once and served as they are.
+    '''
+    def put(self, job_id, result):
+        '''
+            Function that stores the result of a job.
+        '''
+        self.write(job_id, self.encode(result))
+
+    def write(self, job_id, payload):
+        '''
+            Function that stores an already encoded result.
+        '''
+        raise NotImplementedError
+
+    def get(self, job_id):
+        '''
+            Function that returns the result of a job, or None if it isn't stored.
+        '''
+        payload = self.get_raw(job_id)
+        return json.loads(payload) if payload is not None else None
+
+    def get_raw(self, job_id):
+        '''
+            Function that returns the encoded result of a job, or None if it isn't stored.
+        '''
+        raise NotImplementedError
+
+    def delete(self, job_id):
+        '''
+            Function that removes the result of a job, if it is stored.
+        '''
+        raise NotImplementedError
+
+    @staticmethod
+    def encode(result):
+        '''
+            Function that serializes a result as compact JSON bytes. orjson would
+            write NaN as null, so the results holding one are encoded by json,
+            which keeps NaN like the rest of the API.
+        '''
+        if orjson is not None and not non_finite(result):
+            return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS) # pylint: disable=no-member
+        return json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+class DiskResultStore(ResultStore):
+    '''
+        Class that stores every result in a results/result-{job_id}.json file.
+    '''
+    def __init__(self, directory='./results'):
+        '''
+            Function to initialize the store with its directory.
+        '''
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, job_id):
+        '''
+            Function that returns the file of a job's result.
+        '''
+        return os.path.join(self.directory, f"result-{job_id}.json")
+
+    def write(self, job_id, payload):
+        with open(self.path(job_id), 'wb') as f:
+            f.write(payload)
+
+    def get_raw(self, job_id):
+        try:
+            with open(self.path(job_id), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, job_id):
+        try:
+            os.remove(self.path(job_id))
+        except FileNotFoundError:
+            pass
+
+class MemoryResultStore(ResultStore):
+    '''
+        Class that keeps the serialized results in memory, bounded by a size cap.
+        The least recently used results and the ones not read for ttl seconds are
+        evicted. With a spill store, the evicted and the too large results are
+        written there instead of being dropped.
+    '''
+    def __init__(self, max_bytes, ttl=0, spill=None):
+        '''
+            Function to initialize the store with its size cap, TTL and spill store.
+        '''
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill = spill
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def write(self, job_id, payload):
+        if len(payload) > self.max_bytes:
+            if self.spill is not None:
+                self.spill.write(job_id, payload)
+            return
+
+        evicted = []
+        with self.lock:
+            self.entries[job_id] = (payload, time.monotonic() + self.ttl)
+            self.size += len(payload)
+            evicted = self.evict()
+
+        self.spill_all(evicted)
+
+    def get_raw(self, job_id):
+        evicted = []
+        with self.lock:
+            evicted = self.evict()
+            entry = self.entries.get(job_id)
+            if entry is not None:
+                # Reading a result refreshes its TTL
+                self.entries[job_id] = (entry[0], time.monotonic() + self.ttl)
+                self.entries.move_to_end(job_id)
+
+        self.spill_all(evicted)
+        if entry is not None:
+            return entry[0]
+        if self.spill is not None:
+            return self.spill.get_raw(job_id)
+        return None
+
+    def delete(self, job_id):
+        with self.lock:
+            entry = self.entries.pop(job_id, None)
+            if entry is not None:
+                self.size -= len(entry[0])
+        if self.spill is not None:
+            self.spill.delete(job_id)
+
+    def evict(self):
+        '''
+            Function that removes the expired results and the least recently used
+            ones above the size cap. Must be called with the lock held.
+        '''
+        evicted = []
+        now = time.monotonic()
+        while self.entries:
+            job_id, (payload, expires_at) = next(iter(self.entries.items()))
+            if self.size <= self.max_bytes and (not self.ttl or expires_at > now):
+                break
+            del self.entries[job_id]
+            self.size -= len(payload)
+            evicted.append((job_id, payload))
+        return evicted
+
+    def spill_all(self, evicted):
+        '''
+            Function that writes the evicted results to the spill store, if any.
+        '''
+        if self.spill is not None:
+            for job_id, payload in evicted:
+                self.spill.write(job_id, payload)
+
+def create_result_store():
+    '''
+        Function that creates the result store selected by TP_RESULT_STORE
+        ("memory" by default, or "disk").
+    '''
+    if os.getenv("TP_RESULT_STORE", "memory") == "disk":
+        return DiskResultStore()
+
+    spill_dir = os.getenv("TP_RESULT_SPILL_DIR", "")
+    return MemoryResultStore(
+        max_bytes=int(os.getenv("TP_RESULT_MAX_BYTES", str(256 * 1024 * 1024))),
+        ttl=float(os.getenv("TP_RESULT_TTL", "0")),
+        spill=DiskResultStore(spill_dir) if spill_dir else None)
@@ -1,9 +1,26 @@
 '''
     This file contains the routes for the webserver.
 '''
+import io
 import json
-from flask import request, jsonify
+import queue
+import time
+from flask import request, jsonify, Response
 from app import webserver
+from app.task_runner import JOB_TYPES, BATCH_JOB_TYPE, STATE_JOB_TYPES, TOP_K_JOB_TYPES
+from app.task_runner import MATRIX_JOB_TYPE
+from app.task_runner import POOL_SHUT_DOWN, QUEUE_FULL
+from app.profiler import SORT_KEYS
+
+# Upper bound of the ?wait=<ms> parameter of the job endpoints
+MAX_WAIT_MS = 30000
+
+# Seconds between the keepalive comments of an idle results stream
+SSE_KEEPALIVE = 15
+
+# Statuses of the job table, by the name the jobs endpoint reports them with
+JOB_STATUSES = {"done": 'completed', "running": None}
+STATUS_NAMES = {status: name for name, status in JOB_STATUSES.items()}
 
 # Example endpoint definition
 @webserver.route('/api/post_endpoint', methods=['POST'])
@@ -29,262 +46,319 @@ def post_endpoint():
 @webserver.route('/api/get_results/<job_id>', methods=['GET'])
 def get_response(job_id):
     '''
-        Function that returns the result of the job with the given job_id
+        Function that returns the result of the job with the given job_id.
+        With ?wait=<ms>, it first waits up to that long for the job to finish.
     '''
     job_id = int(job_id)
-    webserver.log.info("Received request for job_id %s", job_id)
-    # Check if the job_id is valid
-    if job_id <= webserver.job_counter:
-        task = webserver.tasks_runner.job_status.get(job_id, None)
-        # Check if the task is still running
-        if task is not None:
-            result = get_result(job_id)
-            webserver.log.info("Task %s is done.", job_id)
-            return jsonify({
-                "status": "done",
-                "data": result
-            }), 200
+    webserver.log.info("Received request for job_id %s", job_id, extra={'job_id': job_id})
 
-        webserver.log.info("Task %s is still running.", job_id)
-        return jsonify({
-            "status": "running"
-        }), 200
+    wait_ms = min(request.args.get('wait', 0, type=int), MAX_WAIT_MS)
+    if wait_ms > 0 and webserver.tasks_runner.jobs.allocated(job_id):
+        webserver.tasks_runner.wait_for_job(job_id, wait_ms / 1000)
 
-    webserver.log.error("Invalid job_id %s.", job_id)
-    return jsonify({
-        "status": "error",
-        "reason": "Invalid job_id"
-    }), 405
+    response, status_code = job_response(job_id)
+    return json_response(response, status_code)
 
-@webserver.route('/api/states_mean', methods=['POST'])
-def states_mean_request():
+@webserver.route('/api/stream_results', methods=['GET'])
+def stream_results():
     '''
-        Function that handles the request for the states_mean endpoint.
+        Function that streams the results of a set of jobs as Server-Sent Events,
+        one "result" event per job as soon as it finishes. The jobs are given as
+        ?job_ids=1,2,3 and the stream ends when all of them are finished, or with
+        a "timeout" event listing the unfinished ones after ?timeout=<ms>.
     '''
-    # Get request data
-    data = request.json
-
-    webserver.logger.info("Received request for states_mean.")
-    return_value = add_task(data, 1)
-    if return_value != -1:
+    try:
+        job_ids = [int(job_id) for job_id in request.args.get('job_ids', '').split(',') if job_id]
+    except ValueError:
         return jsonify({
-            "status": "done",
-            "job_id": return_value
-        }), 200
-
-    return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
-
-@webserver.route('/api/state_mean', methods=['POST'])
-def state_mean_request():
-    '''
-        Function that handles the request for the state_mean endpoint.
-    '''
-    # Get request data
-    data = request.json
-
-    webserver.logger.info("Received request for state_mean.")
-    return_value = add_task(data, 2)
-    if return_value != -1:
+            "status": "error",
+            "reason": "Invalid job_ids"
+        }), 400
+    timeout = min(request.args.get('timeout', MAX_WAIT_MS, type=int), MAX_WAIT_MS) / 1000
+    webserver.log.info("Streaming the results of %d jobs", len(job_ids))
+
+    def events():
+        listener = queue.Queue()
+        steps = result_events(job_ids, timeout, listener)
+        job_id = None
+        try:
+            while True:
+                step = steps.send(job_id)
+                job_id = None
+                if isinstance(step, bytes):
+                    yield step
+                else:
+                    try:
+                        job_id = listener.get(timeout=step)
+                    except queue.Empty:
+                        pass
+        except StopIteration:
+            return
+        finally:
+            steps.close()
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+def result_events(job_ids, timeout, listener):
+    '''
+        Function (a generator) that runs a results stream, for both the Flask route
+        and the ASGI application. It yields either an event to send (bytes) or the
+        seconds to wait for the next finished job; the caller waits for the listener
+        the way it can, then sends back the job_id, or None if none finished in time.
+    '''
+    pending = set(job_ids)
+    # Job ids that were never allocated are reported right away
+    jobs = webserver.tasks_runner.jobs
+    unallocated = sorted(job_id for job_id in pending if not jobs.allocated(job_id))
+    pending.difference_update(unallocated)
+    webserver.tasks_runner.subscribe(pending, listener)
+    deadline = time.monotonic() + timeout
+    try:
+        for job_id in unallocated:
+            yield result_event(job_id)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield f"event: timeout\ndata: {json.dumps(sorted(pending))}\n\n".encode('utf-8')
+                return
+            job_id = yield min(remaining, SSE_KEEPALIVE)
+            if job_id is None:
+                yield b": keepalive\n\n"
+            elif job_id in pending:
+                pending.discard(job_id)
+                yield result_event(job_id)
+    finally:
+        webserver.tasks_runner.unsubscribe(pending, listener)
+
+def result_event(job_id):
+    '''
+        Function that returns the "result" event of a job.
+    '''
+    response, _ = job_response(job_id)
+    response['job_id'] = job_id
+    return b"event: result\ndata: " + encode_response(response) + b"\n\n"
+
+def job_handler(name, job_type):
+    '''
+        Function that returns the handler of the endpoint of a job type.
+        Every job endpoint goes through the same pipeline: the request is
+        validated, and its JSON body becomes the task, without being copied.
+    '''
+    def handler():
+        data = request.get_json(silent=True)
+        if not valid_request(data, job_type):
+            webserver.log.warning("Invalid %s request.", name)
+            return jsonify({
+                "status": "error",
+                "reason": "Invalid request, a question (and a state) is required"
+            }), 400
+        return task_response(add_task(data, job_type))
+
+    handler.__name__ = f"{name}_request"
+    handler.__doc__ = f"Handler of the {name} endpoint."
+    return handler
+
+# Registers the endpoint of every job type, /api/<name>
+for job_name, job_type_id in JOB_TYPES.items():
+    webserver.add_url_rule(f'/api/{job_name}', view_func=job_handler(job_name, job_type_id),
+                           methods=['POST'])
+
+@webserver.route('/api/batch', methods=['POST'])
+def batch_request():
+    '''
+        Function that handles the request for the batch endpoint. The request holds
+        a list of queries, each one with a job_type (the name of its endpoint),
+        a question and a state, computed together as a single job.
+    '''
+    data = request.get_json(silent=True)
+    queries = data.get('queries') if isinstance(data, dict) else None
+    if not isinstance(queries, list) or not all(valid_query(query) for query in queries):
         return jsonify({
-            "status": "done",
-            "job_id": return_value
-        }), 200
+            "status": "error",
+            "reason": "Invalid batch queries"
+        }), 400
 
-    return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
+    data['queries'] = [dict(query, job_type=JOB_TYPES[query['job_type']]) for query in queries]
+    return task_response(add_task(data, BATCH_JOB_TYPE))
 
-@webserver.route('/api/best5', methods=['POST'])
-def best5_request():
+@webserver.route('/api/graceful_shutdown', methods=['GET'])
+def graceful_shutdown():
     '''
-        Function that handles the request for the best5 endpoint.
+        Function that triggers the graceful_shutdown Event in the ThreadPool.
+        The Thread Pool will finish all the tasks in the queue before shutting down.
     '''
-    # Get request data
-    data = request.json
-
-    webserver.logger.info("Received request for best5.")
-    return_value = add_task(data, 3)
-    if return_value != -1:
-        return jsonify({
-            "status": "done",
-            "job_id": return_value
-        }), 200
-
+    webserver.logger.info("graceful_shutdown request called")
+    webserver.tasks_runner.shutdown()
     return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
+        "status": "done"
+    }), 200
 
-@webserver.route('/api/worst5', methods=['POST'])
-def worst5_request():
+@webserver.route('/api/jobs', methods=['GET'])
+def get_jobs():
     '''
-        Function that handles the request for the worst5 endpoint.
+        Function to get the status of all the tasks.
+        ?status=done,running (also failed, shed, rejected or evicted) only lists the jobs
+        with these statuses, and ?start=<job_id>&limit=<n> returns a page of jobs,
+        along with the start of the next page (null after the last one).
     '''
-    # Get request data
-    data = request.json
-
-    webserver.logger.info("Received request for worst5.")
-    return_value = add_task(data, 4)
-    if return_value != -1:
+    webserver.logger.info("jobs request called")
+    statuses = request.args.get('status')
+    if statuses is not None:
+        statuses = {JOB_STATUSES.get(status, status) for status in statuses.split(',')}
+    start = request.args.get('start', 1, type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(limit, 1)
+
+    end = webserver.tasks_runner.jobs.end()
+    jobs = webserver.tasks_runner.jobs.jobs(end, start, statuses, limit)
+    data = [{job_id: STATUS_NAMES.get(status, status)} for job_id, status in jobs]
+    if limit is None:
         return jsonify({
             "status": "done",
-            "job_id": return_value
+            "data": data
         }), 200
 
+    next_start = jobs[-1][0] + 1 if len(jobs) == limit else None
+    if next_start is not None and next_start >= end:
+        next_start = None
     return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
+        "status": "done",
+        "data": data,
+        "next_start": next_start
+    }), 200
 
-@webserver.route('/api/global_mean', methods=['POST'])
-def global_mean_request():
+@webserver.route('/api/num_jobs', methods=['GET'])
+def get_num_jobs():
     '''
-        Function that handles the request for the global_mean endpoint.
+        Function to get the number of tasks that are still being processed
     '''
-    # Get request data
-    data = request.json
-
-    webserver.logger.info("Received request for global_mean.")
-    return_value = add_task(data, 5)
-    if return_value != -1:
-        return jsonify({
-            "status": "done",
-            "job_id": return_value
-        }), 200
-
+    webserver.logger.info("num_jobs request called")
     return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
+        "status": "done",
+        "data": webserver.tasks_runner.jobs.num_running()
+    }), 200
 
-@webserver.route('/api/diff_from_mean', methods=['POST'])
-def diff_from_mean_request():
+@webserver.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
     '''
-        Function that handles the request for the diff_from_mean endpoint.
+        Function to get the hit, miss and eviction counters of the result cache
     '''
-    # Get request data
-    data = request.json
-
-    webserver.logger.info("Received request for diff_from_mean.")
-    return_value = add_task(data, 6)
-    if return_value != -1:
-        return jsonify({
-            "status": "done",
-            "job_id": return_value
-        }), 200
-
+    webserver.logger.info("cache_stats request called")
     return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
+        "status": "done",
+        "data": webserver.tasks_runner.result_cache.stats()
+    }), 200
 
-@webserver.route('/api/state_diff_from_mean', methods=['POST'])
-def state_diff_from_mean_request():
+@webserver.route('/api/queue_stats', methods=['GET'])
+def get_queue_stats():
     '''
-        Function that handles the request for the state_diff_from_mean endpoint.
+        Function to get the queue-wait statistics of the scheduler lanes
     '''
-    # Get request data
-    data = request.json
-
-    webserver.logger.info("Received request for state_diff_from_mean.")
-    return_value = add_task(data, 7)
-    if return_value != -1:
-        return jsonify({
-            "status": "done",
-            "job_id": return_value
-        }), 200
-
+    webserver.logger.info("queue_stats request called")
     return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
-
-@webserver.route('/api/mean_by_category', methods=['POST'])
-def mean_by_category_request():
-    '''
-        Function that handles the request for the mean_by_category endpoint.
-    '''
-    # Get request data
-    data = request.json
+        "status": "done",
+        "data": webserver.tasks_runner.tasks.stats()
+    }), 200
 
-    webserver.logger.info("Received request for mean_by_category.")
-    return_value = add_task(data, 8)
-    if return_value != -1:
+@webserver.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    '''
+        Function to get the metrics of the thread pool, in the Prometheus text format
+    '''
+    thread_pool = webserver.tasks_runner
+    busy = sum(1 for worker in thread_pool.workers if worker.busy)
+    gauges = {
+        "task_queue_depth": ("Tasks waiting in the queue", thread_pool.tasks.qsize()),
+        "task_runners_busy": ("TaskRunner threads processing a task", busy),
+        "task_runners_idle": ("TaskRunner threads waiting for a task",
+                              len(thread_pool.workers) - busy),
+    }
+    return Response(thread_pool.metrics.render(gauges),
+                    mimetype='text/plain; version=0.0.4'), 200
+
+@webserver.route('/api/ingest', methods=['POST'])
+def ingest():
+    '''
+        Function that appends the rows of the CSV chunk in the request body
+        (with the header of the dataset) and publishes them as a new version.
+        Jobs already running finish on the version they started with.
+    '''
+    webserver.logger.info("ingest request called")
+    try:
+        version, rows = webserver.data_ingestor.append(io.BytesIO(request.get_data()))
+    except (ValueError, TypeError) as error:
+        webserver.logger.warning("Ingest rejected: %s", error)
         return jsonify({
-            "status": "done",
-            "job_id": return_value
-        }), 200
+            "status": "error",
+            "reason": f"Invalid CSV chunk: {error}"
+        }), 400
 
+    webserver.logger.info("Ingested %d rows, dataset version %d", rows, version)
     return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
+        "status": "done",
+        "data": {"version": version, "rows": rows}
+    }), 200
 
-@webserver.route('/api/state_mean_by_category', methods=['POST'])
-def state_mean_by_category_request():
+@webserver.route('/api/admin/profile', methods=['GET', 'POST'])
+def profile():
     '''
-        Function that handles the request for the state_mean_by_category endpoint.
+        Function that controls the profiler of the tasks.
+        POST starts profiling, with an optional "job_type" (endpoint name, all job
+        types by default), "next_jobs" (profile the next N tasks) and "sample_rate"
+        (then profile that fraction of them). {"stop": true} stops it.
+        GET returns the status and the aggregated stats (?sort=, ?limit=),
+        and with ?dump=1 also writes them to a pstats file.
     '''
-    # Get request data
-    data = request.json
-
-    webserver.logger.info("Received request for state_mean_by_category.")
-    return_value = add_task(data, 9)
-    if return_value != -1:
+    profiler = webserver.tasks_runner.profiler
+    if request.method == 'POST':
+        data = request.get_json(silent=True) if request.get_data() else {}
+        webserver.logger.info("profile request called")
+        if not isinstance(data, dict):
+            return jsonify({
+                "status": "error",
+                "reason": "Invalid request, a JSON object is required"
+            }), 400
+        if data.get('stop'):
+            profiler.stop()
+        else:
+            job_type = data.get('job_type')
+            if job_type is not None and job_type not in JOB_TYPES and job_type != 'batch':
+                return jsonify({
+                    "status": "error",
+                    "reason": "Invalid job_type"
+                }), 400
+            try:
+                sample_rate = float(data.get('sample_rate', 0.0))
+                next_jobs = int(data.get('next_jobs', 0))
+            except (TypeError, ValueError):
+                sample_rate, next_jobs = -1, -1
+            if not 0 <= sample_rate <= 1 or next_jobs < 0:
+                return jsonify({
+                    "status": "error",
+                    "reason": "Invalid sample_rate or next_jobs"
+                }), 400
+            job_type = BATCH_JOB_TYPE if job_type == 'batch' else JOB_TYPES.get(job_type)
+            profiler.configure(job_type=job_type, sample_rate=sample_rate, next_jobs=next_jobs)
         return jsonify({
             "status": "done",
-            "job_id": return_value
+            "data": profiler.status()
         }), 200
 
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in SORT_KEYS:
+        return jsonify({
+            "status": "error",
+            "reason": "Invalid sort"
+        }), 400
+    data = profiler.status()
+    data['stats'] = profiler.report(sort, request.args.get('limit', 40, type=int))
+    if request.args.get('dump') == '1':
+        data['pstats_file'] = profiler.dump()
     return jsonify({
-        "status": "error",
-        "reason": "Thread Pool is shutting down, no more tasks can be added."
-    }), 405
-
-@webserver.route('/api/graceful_shutdown', methods=['GET'])
-def graceful_shutdown():
-    '''
-        Function that triggers the graceful_shutdown Event in the ThreadPool.
-        The Thread Pool will finish all the tasks in the queue before shutting down.
-    '''
-    webserver.logger.info("graceful_shutdown request called")
-    webserver.tasks_runner.shutdown()
-    return jsonify({
-        "status": "done"
-    }), 200
-
-@webserver.route('/api/jobs', methods=['GET'])
-def get_jobs():
-    '''
-        Function to get the status of all the tasks
-    '''
-    webserver.logger.info("jobs request called")
-    jobs = []
-
-    for job_id in range(1, webserver.job_counter):
-        if job_id in webserver.tasks_runner.job_status:
-            jobs.append({job_id: "done"})
-        else:
-            jobs.append({job_id: "running"})
-
-    return jsonify({
-        "status": "done", 
-        "data": jobs
-    }), 200
-
-@webserver.route('/api/num_jobs', methods=['GET'])
-def get_num_jobs():
-    '''
-        Function to get the number of tasks that are still being processed
-    '''
-    webserver.logger.info("num_jobs request called")
-    return jsonify({
-        "status": "done", 
-        "data": webserver.job_counter - len(webserver.tasks_runner.job_status)
+        "status": "done",
+        "data": data
     }), 200
 
 # You can check localhost in your browser to see what this displays
@@ -317,25 +391,182 @@ def get_defined_routes():
 
 def add_task(data, job_type):
     '''
-        Function that adds a task to the queue.
+        Function that adds a task to the queue, under a new job_id.
     '''
-    webserver.log.info("Adding task %s of type %s", data, job_type)
-    data['job_id'] = webserver.job_counter
+    # Allocated atomically, concurrent requests never get the same job_id
+    data['job_id'] = next(webserver.job_ids)
     data['job_type'] = job_type
     result = webserver.tasks_runner.add_task(data)
 
-    if result != -1:
-        webserver.log.info("Task %s added to the queue.", data['job_id'])
-        webserver.job_counter += 1
-        return result
+    if result not in (POOL_SHUT_DOWN, QUEUE_FULL):
+        webserver.log.info("Task %d of type %d added to the queue.", result, job_type,
+                           extra={'job_id': result})
+    else:
+        webserver.log.warning("Task %d of type %d was not registered.", data['job_id'], job_type)
+    return result
+
+def valid_request(data, job_type):
+    '''
+        Function that checks the body of a job request: a question, and a state
+        for the job types that depend on it.
+    '''
+    if job_type == MATRIX_JOB_TYPE:
+        return valid_matrix(data)
+    if not isinstance(data, dict) or not isinstance(data.get('question'), str):
+        return False
+    if job_type in TOP_K_JOB_TYPES:
+        return valid_top_k(data)
+    return job_type not in STATE_JOB_TYPES or isinstance(data.get('state'), str)
+
+def valid_top_k(data):
+    '''
+        Function that checks the optional parameters of a best_k / worst_k request:
+        a positive k, and a stratification given with its category.
+    '''
+    k = data.get('k', 5)
+    if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+        return False
+    category = data.get('stratification_category')
+    stratification = data.get('stratification')
+    if category is None and stratification is None:
+        return True
+    return isinstance(category, str) and isinstance(stratification, str)
+
+def valid_matrix(data):
+    '''
+        Function that checks a state_question_matrix request: its optional
+        'states' and 'questions' are lists of names.
+    '''
+    if not isinstance(data, dict):
+        return False
+    for labels in (data.get('states'), data.get('questions')):
+        if labels is not None and (
+                not isinstance(labels, list) or
+                not all(isinstance(label, str) for label in labels)):
+            return False
+    return True
+
+def valid_query(query):
+    '''
+        Function that checks a query of a batch request.
+    '''
+    if not isinstance(query, dict) or query.get('job_type') not in JOB_TYPES:
+        return False
+    return valid_request(query, JOB_TYPES[query['job_type']])
+
+def task_response(job_id):
+    '''
+        Function that builds the response of a job endpoint. With ?wait=<ms>,
+        it waits up to that long for the job and returns its result inline
+        if it finished in time, otherwise it only returns the job_id.
+    '''
+    if job_id == POOL_SHUT_DOWN:
+        return jsonify({
+            "status": "error",
+            "reason": "Thread Pool is shutting down, no more tasks can be added."
+        }), 405
+
+    if job_id == QUEUE_FULL:
+        response = jsonify({
+            "status": "error",
+            "reason": "Too many queued tasks, retry later."
+        })
+        response.headers['Retry-After'] = str(webserver.tasks_runner.tasks.retry_after())
+        return response, 429
+
+    wait_ms = min(request.args.get('wait', 0, type=int), MAX_WAIT_MS)
+    if wait_ms > 0 and webserver.tasks_runner.wait_for_job(job_id, wait_ms / 1000):
+        result = get_result(job_id)
+        if result is not None:
+            return json_response({
+                "status": "done",
+                "job_id": job_id,
+                "data": result
+            }, 200)
+
+    return jsonify({
+        "status": "done",
+        "job_id": job_id
+    }), 200
 
-    webserver.log.warning("Task was not registered.")
-    return -1
+def job_response(job_id): # pylint: disable=too-many-return-statements
+    '''
+        Function that builds the status, and the result if it is finished,
+        of a job. Returns the response and its HTTP status code.
+        The result is left encoded, see encode_response.
+    '''
+    # Check if the job_id is valid
+    if not webserver.tasks_runner.jobs.allocated(job_id):
+        webserver.log.error("Invalid job_id %s.", job_id)
+        return {
+            "status": "error",
+            "reason": "Invalid job_id"
+        }, 405
+
+    task = webserver.tasks_runner.jobs.status(job_id)
+    webserver.tasks_runner.metrics.increment(
+        'result_fetches_total', (('status', task or 'running'),))
+    if task == 'failed':
+        webserver.log.error("Task %s failed.", job_id)
+        return {
+            "status": "error",
+            "reason": "Job failed"
+        }, 500
+
+    if task == 'shed':
+        webserver.log.warning("Task %s was shed from the full queue.", job_id)
+        return {
+            "status": "error",
+            "reason": "Job was shed from the full queue"
+        }, 503
+
+    if task == 'rejected':
+        webserver.log.warning("Task %s was rejected.", job_id)
+        return {
+            "status": "error",
+            "reason": "Job was rejected"
+        }, 404
+
+    # Check if the task is still running
+    if task is None:
+        webserver.log.info("Task %s is still running.", job_id, extra={'job_id': job_id})
+        return {
+            "status": "running"
+        }, 200
+
+    result = get_result(job_id)
+    if result is None:
+        webserver.log.error("Result of task %s is no longer available.", job_id)
+        return {
+            "status": "error",
+            "reason": "Result is no longer available"
+        }, 404
+
+    webserver.log.info("Task %s is done.", job_id, extra={'job_id': job_id})
+    return {
+        "status": "done",
+        "data": result
+    }, 200
 
 def get_result(job_id):
     '''
-        Function that gets the result of a task.
+        Function that gets the result of a task, encoded as JSON bytes.
     '''
-    with open(f"results/result-{job_id}.json", "r", encoding="utf-8") as f:
-        result = json.load(f)
-    return result
+    return webserver.tasks_runner.result_store.get_raw(job_id)
+
+def encode_response(response):
+    '''
+        Function that encodes a response as JSON bytes. An encoded result in its
+        "data" field is spliced in as it is, without being decoded.
+    '''
+    payload = response.get('data')
+    if not isinstance(payload, bytes):
+        return json.dumps(response).encode('utf-8')
+    envelope = json.dumps({key: value for key, value in response.items() if key != 'data'})
+    return envelope[:-1].encode('utf-8') + b', "data": ' + payload + b'}'
+
+def json_response(response, status_code):
+    '''
+        Function that returns a Flask JSON response for encode_response.
+    '''
+    return Response(encode_response(response), status=status_code, mimetype='application/json')
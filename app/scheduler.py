@@ -0,0 +1,184 @@
+'''
+    This module implements the scheduler that replaces the FIFO queue of tasks.
+'''
+from collections import deque
+from threading import Condition
+import heapq
+import itertools
+import math
+import queue
+import time
+
+class Lane: # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    '''
+        Class that holds the tasks of one lane, ordered by priority and arrival.
+        The heap may still hold entries of shed tasks, size counts the queued ones.
+    '''
+    def __init__(self, name, weight):
+        '''
+            Function to initialize an empty lane.
+        '''
+        self.name = name
+        self.weight = weight
+        self.heap = []
+        self.size = 0
+
+        # Cost served so far divided by the weight, the lane with the lowest one goes next
+        self.virtual_time = 0.0
+
+        # Queue-wait statistics
+        self.dequeued = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self):
+        '''
+            Function that returns the queue-wait statistics of the lane.
+        '''
+        return {
+            "queued": self.size,
+            "dequeued": self.dequeued,
+            "mean_wait": self.total_wait / self.dequeued if self.dequeued else 0.0,
+            "max_wait": self.max_wait
+        }
+
+class Scheduler: # pylint: disable=too-many-instance-attributes
+    '''
+        Class that schedules the tasks in a light and a heavy lane, by estimated cost.
+        The lanes are served weighted-fair on the cost of the tasks they ran, so a
+        burst of heavy tasks can't starve the light ones or the other way around.
+        Within a lane, tasks with a higher priority go first, then the oldest ones.
+    '''
+    def __init__(self, light_cost, max_depth=0, policy="reject"):
+        '''
+            Function to initialize the scheduler. Tasks costing at most light_cost
+            go to the light lane. With a max_depth, a full scheduler either rejects
+            new tasks (policy "reject") or sheds its oldest task with the lowest
+            priority to make room (policy "shed_oldest").
+        '''
+        self.light_cost = light_cost
+        self.max_depth = max_depth
+        self.policy = policy
+        self.lanes = {"light": Lane("light", 1.0), "heavy": Lane("heavy", 1.0)}
+        self.sequence = itertools.count()
+        self.condition = Condition()
+        self.size = 0
+
+        # Lane and task of every queued task, by sequence. A shed task is only
+        # removed from here, its entry is skipped when it reaches the top of its lane
+        self.queued = {}
+        # (priority, sequence) of the tasks, lowest priority and oldest first, to pick
+        # the task to shed. It may hold tasks already dequeued, skipped the same way
+        self.shed_heap = []
+
+        # When the last tasks were dequeued, to estimate the drain rate
+        self.dequeue_times = deque(maxlen=100)
+
+    def put(self, task, cost, priority=0):
+        '''
+            Function that adds a task to the lane matching its cost.
+            Returns the task shed to make room for it, if any, and raises
+            queue.Full if the task was rejected.
+        '''
+        lane = self.lanes["light" if cost <= self.light_cost else "heavy"]
+        with self.condition:
+            shed = None
+            if self.max_depth and self.size >= self.max_depth:
+                shed = self.shed(priority)
+
+            if not lane.size:
+                # A lane coming back from idle doesn't get credit for the time it was empty
+                busy = [other.virtual_time for other in self.lanes.values() if other.size]
+                if busy:
+                    lane.virtual_time = max(lane.virtual_time, min(busy))
+            sequence = next(self.sequence)
+            heapq.heappush(lane.heap, (-priority, sequence, time.monotonic(), cost, task))
+            self.queued[sequence] = (lane, task)
+            if self.policy == "shed_oldest" and self.max_depth:
+                heapq.heappush(self.shed_heap, (priority, sequence))
+            lane.size += 1
+            self.size += 1
+            self.condition.notify()
+            return shed
+
+    def shed(self, priority):
+        '''
+            Function that removes the oldest queued task with the lowest priority,
+            if the policy allows it and that priority isn't above the given one.
+            Must be called with the condition held.
+        '''
+        if self.policy != "shed_oldest":
+            raise queue.Full
+
+        while self.shed_heap and self.shed_heap[0][1] not in self.queued:
+            heapq.heappop(self.shed_heap)
+        if not self.shed_heap or self.shed_heap[0][0] > priority:
+            raise queue.Full
+
+        _, sequence = heapq.heappop(self.shed_heap)
+        lane, task = self.queued.pop(sequence)
+        lane.size -= 1
+        self.size -= 1
+        # Rebuilds the lane's heap once it holds more shed entries than queued ones
+        if len(lane.heap) > 2 * lane.size + 64:
+            lane.heap = [entry for entry in lane.heap if entry[1] in self.queued]
+            heapq.heapify(lane.heap)
+        return task
+
+    def get(self, timeout=None):
+        '''
+            Function that removes and returns the next task, blocking up to timeout
+            seconds. Raises queue.Empty if no task arrived in time.
+        '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.size > 0, timeout):
+                raise queue.Empty
+
+            lane = min((lane for lane in self.lanes.values() if lane.size),
+                       key=lambda lane: lane.virtual_time)
+            _, sequence, enqueued_at, cost, task = heapq.heappop(lane.heap)
+            while sequence not in self.queued:
+                _, sequence, enqueued_at, cost, task = heapq.heappop(lane.heap)
+            del self.queued[sequence]
+            lane.size -= 1
+            self.size -= 1
+            # Rebuilds the shed heap once it holds more dequeued tasks than queued ones
+            if len(self.shed_heap) > 2 * self.size + 64:
+                self.shed_heap = [item for item in self.shed_heap if item[1] in self.queued]
+                heapq.heapify(self.shed_heap)
+
+            now = time.monotonic()
+            self.dequeue_times.append(now)
+            wait = now - enqueued_at
+            lane.virtual_time += cost / lane.weight
+            lane.dequeued += 1
+            lane.total_wait += wait
+            lane.max_wait = max(lane.max_wait, wait)
+            return task
+
+    def qsize(self):
+        '''
+            Function that returns the number of queued tasks.
+        '''
+        return self.size
+
+    def retry_after(self):
+        '''
+            Function that estimates in how many seconds the queue will have drained,
+            from the rate the last tasks were dequeued at (between 1 and 60 seconds).
+        '''
+        with self.condition:
+            if len(self.dequeue_times) < 2:
+                return 1
+            elapsed = self.dequeue_times[-1] - self.dequeue_times[0]
+            if elapsed <= 0:
+                return 1
+            rate = (len(self.dequeue_times) - 1) / elapsed
+            return min(60, max(1, math.ceil(self.size / rate)))
+
+    def stats(self):
+        '''
+            Function that returns the queue-wait statistics of every lane.
+        '''
+        with self.condition:
+            return {name: lane.stats() for name, lane in self.lanes.items()}
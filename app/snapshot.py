@@ -0,0 +1,107 @@
+"""
+    This file contains the binary columnar snapshot of the compact dataset.
+    Every column is saved as a .npy file (integer codes for the categorical
+    columns, floats for 'Data_Value') next to a manifest.json holding the
+    string dictionaries and the fingerprint of the CSV it was built from.
+    The snapshot is opened with memory mapping, so restarts and several server
+    processes on the same host share the page cache instead of parsing the CSV.
+"""
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+def snapshot_dir_for(csv_path):
+    '''
+        Returns the directory of the snapshot of the given CSV
+    '''
+    return os.getenv("DI_SNAPSHOT_DIR", f"{csv_path}.snapshot")
+
+def source_fingerprint(csv_path, value_dtype):
+    '''
+        Returns what identifies the CSV a snapshot was built from: its size,
+        its modification time and the dtype 'Data_Value' was loaded with
+    '''
+    stat = os.stat(csv_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'value_dtype': value_dtype}
+
+def write_snapshot(data, snapshot_dir, fingerprint):
+    '''
+        Writes the columns of the compact DataFrame into snapshot_dir.
+        The files are written in a temporary directory that is renamed at the
+        end, so a reader finds either a complete snapshot or none (and reads
+        the CSV), never a half written one.
+    '''
+    tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'fingerprint': fingerprint,
+        'rows': len(data),
+        'columns': {}
+    }
+    for column in data.columns:
+        file_name = f"{column}.npy"
+        if isinstance(data[column].dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, file_name), data[column].cat.codes.to_numpy())
+            manifest['columns'][column] = {
+                'file': file_name,
+                'categories': data[column].cat.categories.tolist()
+            }
+        else:
+            np.save(os.path.join(tmp_dir, file_name), data[column].to_numpy())
+            manifest['columns'][column] = {'file': file_name}
+
+    with open(os.path.join(tmp_dir, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    # A directory can only be renamed over an empty one, so the current snapshot
+    # is first renamed aside, then removed once the new one is in place
+    aside = f"{snapshot_dir}.old-{os.getpid()}"
+    try:
+        os.rename(snapshot_dir, aside)
+    except FileNotFoundError:
+        pass
+    try:
+        os.replace(tmp_dir, snapshot_dir)
+    except OSError:
+        # Another process published its snapshot in between, that one is kept
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(aside, ignore_errors=True)
+
+def read_snapshot(snapshot_dir, fingerprint):
+    '''
+        Opens the snapshot as a DataFrame backed by read-only memory maps.
+        Returns None if there is no snapshot, if it was built from another CSV,
+        or if it can't be read (another process may be replacing it).
+    '''
+    try:
+        with open(os.path.join(snapshot_dir, MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('version') != SNAPSHOT_VERSION or manifest.get('fingerprint') != fingerprint:
+        return None
+
+    columns = {}
+    for column, spec in manifest['columns'].items():
+        try:
+            values = np.load(os.path.join(snapshot_dir, spec['file']), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if len(values) != manifest['rows']:
+            return None
+        if 'categories' in spec:
+            # The codes are wrapped as they are, no validation pass and no copy
+            values = pd.Categorical.from_codes(
+                values, categories=spec['categories'], validate=False)
+        columns[column] = pd.Series(values, copy=False)
+
+    return pd.DataFrame(columns, copy=False)
@@ -1,14 +1,107 @@
 '''
     This module implements a thread pool to process tasks concurrently.
 '''
-from queue import Queue
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 import os
-import json
 import queue
-from app.data_ingestor import DataIngestor
+import time
+import numpy as np
+from app.data_ingestor import DataIngestor, state_question_sums
+from app.result_cache import ResultCache
+from app.result_store import create_result_store
+from app.process_backend import ProcessBackend
+from app.scheduler import Scheduler
+from app.metrics import Metrics
+from app.profiler import JobProfiler
+from app.job_table import JobTable
 
-class ThreadPool:
+# Job types, by the name of their endpoint
+JOB_TYPES = {
+    'states_mean': 1,
+    'state_mean': 2,
+    'best5': 3,
+    'worst5': 4,
+    'global_mean': 5,
+    'diff_from_mean': 6,
+    'state_diff_from_mean': 7,
+    'mean_by_category': 8,
+    'state_mean_by_category': 9,
+    'best_k': 11,
+    'worst_k': 12,
+    'state_question_matrix': 13
+}
+
+# Job type of a list of queries computed together
+BATCH_JOB_TYPE = 10
+
+# Name of every job type, used as the label of its metrics and to dispatch it
+# to the TaskProcessor method of the same name
+JOB_TYPE_NAMES = {job_type: name for name, job_type in JOB_TYPES.items()}
+JOB_TYPE_NAMES[BATCH_JOB_TYPE] = 'batch'
+
+# Job types whose result depends on the requested state
+STATE_JOB_TYPES = (2, 7, 9)
+
+# Job types returning the k best or worst states, optionally for one stratification
+TOP_K_JOB_TYPES = (11, 12)
+
+# Job type of the (state x question) matrix of means, over all the questions
+MATRIX_JOB_TYPE = 13
+
+# Estimated relative cost of every job type, by the work and the size of the result
+JOB_COSTS = {1: 2, 2: 1, 3: 2, 4: 2, 5: 1, 6: 2, 7: 1, 8: 8, 9: 2, 11: 2, 12: 2, 13: 8}
+
+# Values returned by add_task when a task is not accepted
+POOL_SHUT_DOWN = -1
+QUEUE_FULL = -2
+
+# Tasks costing at most this much are scheduled in the light lane
+LIGHT_COST = 2
+
+def task_cost(task):
+    '''
+        Function that returns the estimated cost of a task.
+    '''
+    if task['job_type'] == BATCH_JOB_TYPE:
+        return sum(JOB_COSTS.get(query['job_type'], 1) for query in task['queries'])
+    return JOB_COSTS.get(task['job_type'], 1)
+
+def task_priority(task):
+    '''
+        Function that returns the priority requested for a task, 0 by default.
+        Tasks with a higher priority are scheduled first within their lane.
+    '''
+    priority = task.get('priority', 0)
+    return priority if isinstance(priority, int) else 0
+
+def task_key(task):
+    '''
+        Function that returns the normalized parameters that identify a task's result.
+    '''
+    if task['job_type'] == BATCH_JOB_TYPE:
+        return (BATCH_JOB_TYPE, tuple(task_key(query) for query in task['queries']))
+    if task['job_type'] == MATRIX_JOB_TYPE:
+        states, questions = task.get('states'), task.get('questions')
+        return (MATRIX_JOB_TYPE, tuple(states) if states is not None else None,
+                tuple(questions) if questions is not None else None)
+    if task['job_type'] in TOP_K_JOB_TYPES:
+        return (task['job_type'], task.get('question'), task.get('k', 5),
+                task.get('stratification_category'), task.get('stratification'))
+    state = task.get('state') if task['job_type'] in STATE_JOB_TYPES else None
+    return (task['job_type'], task.get('question'), state)
+
+def select_labels(labels, observed, requested):
+    '''
+        Function that returns the selected labels and their positions: the requested
+        labels in their order (the unknown ones at the last, empty position), or
+        else the observed labels ordered by name.
+    '''
+    positions = {label: i for i, label in enumerate(labels)}
+    if requested is None:
+        requested = sorted(label for label, seen in zip(labels, observed) if seen)
+    return list(requested), [positions.get(label, len(labels)) for label in requested]
+
+class ThreadPool: # pylint: disable=too-many-instance-attributes
     '''
         Class that implements a thread pool to process tasks concurrently.
     '''
@@ -22,24 +115,55 @@ class ThreadPool:
         # Event to signal the Thread Pool to shutdown.
         self.graceful_shutdown = Event()
 
-        # Queue of tasks that wait to be executed
-        self.tasks = Queue()
+        # Tasks that wait to be executed, in a light and a heavy lane, at most
+        # TP_MAX_QUEUE_DEPTH of them (0 for no limit)
+        self.tasks = Scheduler(LIGHT_COST,
+                               max_depth=int(os.getenv("TP_MAX_QUEUE_DEPTH", "10000")),
+                               policy=os.getenv("TP_ADMISSION_POLICY", "reject"))
 
         # List of thread workers
         self.workers = []
 
-        # Dictionary to map the job_id to the task status
-        self.job_status = {}
+        # Status of every job_id, keeping the last TP_JOB_RETENTION jobs (0 keeps all)
+        self.jobs = JobTable(int(os.getenv("TP_JOB_RETENTION", "100000")))
+
+        # Completion event of every unfinished job, and the queues of the
+        # subscribers waiting for jobs, notified with the finished job_ids
+        self.job_events = {}
+        self.job_listeners = {}
+        self.job_events_lock = Lock()
+
+        # Queued or running tasks, mapping the task_key to the job_ids waiting for it
+        self.in_flight = {}
+        self.in_flight_lock = Lock()
 
         self.data_ingestor = DataIngestor("./nutrition_activity_obesity_usa_subset.csv")
         self.logger = logger
 
+        # Results shared by all the workers, bounded by TP_CACHE_MAX_BYTES
+        self.result_cache = ResultCache(int(os.getenv("TP_CACHE_MAX_BYTES", str(64 * 1024 * 1024))))
+
+        # Results of the finished jobs, kept in memory unless TP_RESULT_STORE=disk
+        self.result_store = create_result_store()
+
+        # Latency histograms and counters, disabled with TP_METRICS=0
+        self.metrics = Metrics(enabled=os.getenv("TP_METRICS", "1") == "1")
+
+        # Profiler of the tasks, started on demand by the admin endpoints
+        self.profiler = JobProfiler()
+
+        # With TP_BACKEND=process the tasks are computed in worker processes
+        self.process_backend = None
+        if os.getenv("TP_BACKEND", "thread") == "process":
+            self.process_backend = ProcessBackend(self.data_ingestor.dataset, self.num_threads)
+            self.logger.info("Process backend started with %d processes.", self.num_threads)
+
         # Logging the thread pool's initialisation
-        self.logger.info(f"Thread pool has been initialised with {self.num_threads} threads.")
+        self.logger.info("Thread pool has been initialised with %d threads.", self.num_threads)
         for i in range(self.num_threads):
             self.workers.append(TaskRunner(self))
             self.workers[i].start()
-            self.logger.info(f"Thread {i} started its job.")
+            self.logger.info("Thread %d started its job.", i)
 
     def shutdown(self):
         '''
@@ -52,20 +176,124 @@ class ThreadPool:
 
             for thread in self.workers:
                 thread.join(timeout=10)
-                self.logger.info(f"Thread {thread.ident} joined.")
+                self.logger.info("Thread %d joined.", thread.ident)
+
+            if self.process_backend is not None:
+                self.process_backend.shutdown()
 
     def add_task(self, task):
         '''
             Function to add a task to the queue.
         '''
+        self.jobs.register(task['job_id'])
+
         # First check if the thread pool hasn't already been shut down
         if not self.graceful_shutdown.is_set():
-            self.tasks.put(task)
-            self.logger.info(f"Task {task['job_id']} added to the queue.")
+            key = task_key(task)
+            task['enqueued_at'] = time.monotonic()
+            with self.job_events_lock:
+                self.job_events[task['job_id']] = Event()
+
+            with self.in_flight_lock:
+                job_ids = self.in_flight.get(key)
+                # An equivalent task is already queued or running, wait for its result
+                if job_ids is not None:
+                    job_ids.append(task['job_id'])
+                    self.logger.info("Task %d attached to the in-flight task %d.",
+                                     task['job_id'], job_ids[0], extra={'job_id': task['job_id']})
+                    return task['job_id']
+                self.in_flight[key] = [task['job_id']]
+
+            try:
+                shed = self.tasks.put(task, task_cost(task), task_priority(task))
+            except queue.Full:
+                # Jobs that attached in the meantime are dropped along with the task
+                job_ids = self.detach_jobs(key)
+                self.finish_jobs(job_ids[1:], 'shed')
+                self.finish_jobs([task['job_id']], 'rejected')
+                self.logger.warning("Task %d rejected, the queue is full.", task['job_id'],
+                                    extra={'job_id': task['job_id']})
+                return QUEUE_FULL
+
+            if shed is not None:
+                self.finish_jobs(self.detach_jobs(task_key(shed)), 'shed')
+                self.logger.warning("Task %d shed to make room in the queue.", shed['job_id'],
+                                    extra={'job_id': shed['job_id']})
+
+            self.logger.info("Task %d added to the queue.", task['job_id'],
+                             extra={'job_id': task['job_id']})
             return task['job_id']
         # If the thread pool has been shut down, log a warning
+        self.finish_jobs([task['job_id']], 'rejected')
         self.logger.warning("Thread Pool has been shut down, tasks can no longer be added.")
-        return -1
+        return POOL_SHUT_DOWN
+
+    def finish_jobs(self, job_ids, status):
+        '''
+            Function that sets the final status of jobs and wakes up their waiters.
+        '''
+        events = []
+        listeners = []
+        with self.job_events_lock:
+            evicted = self.jobs.finish(job_ids, status)
+            for job_id in job_ids:
+                events.append(self.job_events.pop(job_id, None))
+                listeners.extend((job_id, listener)
+                                 for listener in self.job_listeners.pop(job_id, []))
+
+        for event in events:
+            if event is not None:
+                event.set()
+        for job_id, listener in listeners:
+            listener.put(job_id)
+
+        # The results of the evicted jobs are removed without holding the lock,
+        # a batch can hold thousands of them
+        for job_id in evicted:
+            self.result_store.delete(job_id)
+
+    def wait_for_job(self, job_id, timeout):
+        '''
+            Function that blocks until the job is finished or the timeout (in seconds)
+            passes. Returns whether the job is finished.
+        '''
+        with self.job_events_lock:
+            event = self.job_events.get(job_id)
+        if event is None:
+            return self.jobs.is_finished(job_id)
+        return event.wait(timeout)
+
+    def subscribe(self, job_ids, listener):
+        '''
+            Function that puts every job_id in the listener queue once the job is
+            finished, right away for the jobs that already are.
+        '''
+        with self.job_events_lock:
+            for job_id in job_ids:
+                if self.jobs.is_finished(job_id):
+                    listener.put(job_id)
+                else:
+                    self.job_listeners.setdefault(job_id, []).append(listener)
+
+    def unsubscribe(self, job_ids, listener):
+        '''
+            Function that removes a listener from the jobs it still waits for.
+        '''
+        with self.job_events_lock:
+            for job_id in job_ids:
+                listeners = self.job_listeners.get(job_id, [])
+                if listener in listeners:
+                    listeners.remove(listener)
+                if not listeners:
+                    self.job_listeners.pop(job_id, None)
+
+    def detach_jobs(self, key):
+        '''
+            Function that returns the job_ids waiting for the task with the given key.
+            Tasks with the same key submitted afterwards are queued again.
+        '''
+        with self.in_flight_lock:
+            return self.in_flight.pop(key)
 
 class TaskRunner(Thread):
     '''
@@ -78,6 +306,9 @@ class TaskRunner(Thread):
         Thread.__init__(self)
         self.thread_pool = thread_pool
 
+        # Whether the thread is processing a task, for the metrics
+        self.busy = False
+
     def run(self):
         '''
             Function to run a loop for the task runner, until the
@@ -86,123 +317,223 @@ class TaskRunner(Thread):
         while not self.thread_pool.graceful_shutdown.is_set():
             try:
                 task = self.thread_pool.tasks.get(timeout=1)
-                self.process_task(task)
             except queue.Empty:
                 continue
+            self.busy = True
+            try:
+                self.process_task(task)
+            finally:
+                self.busy = False
 
     def process_task(self, task):
         '''
             Function that simulates the work of a thread.
         '''
-        self.thread_pool.logger.info(f"Processing task {task['job_id']}.")
-        processor = TaskProcessor(self.thread_pool.data_ingestor)
-        result = processor.compute_result(task)
-        self.write_result(task['job_id'], result)
-        self.thread_pool.logger.info(f"Task {task['job_id']} has been processed.")
-        self.thread_pool.job_status[task['job_id']] = 'completed'
+        self.thread_pool.logger.info("Processing task %d.", task['job_id'],
+                                     extra={'job_id': task['job_id']})
+        metrics = self.thread_pool.metrics
+        labels = (('job_type', JOB_TYPE_NAMES.get(task['job_type'], 'unknown')),)
+        key = task_key(task)
+        profiler = self.thread_pool.profiler
+        profiled = profiler.should_profile(task['job_type'])
+
+        started_at = time.monotonic()
+        metrics.observe('task_queue_wait_seconds', labels, started_at - task['enqueued_at'])
+        try:
+            # A profiled task is computed even if its result is cached
+            result = profiler.run(profiled, self.compute, task, key, not profiled)
+        except Exception: # pylint: disable=broad-exception-caught
+            # A failing task must not take the thread down with it
+            self.thread_pool.logger.exception("Task %d failed.", task['job_id'],
+                                              extra={'job_id': task['job_id']})
+            metrics.increment('tasks_failed_total', labels)
+            self.thread_pool.finish_jobs(self.thread_pool.detach_jobs(key), 'failed')
+            return
+        computed_at = time.monotonic()
+        metrics.observe('task_compute_seconds', labels, computed_at - started_at)
+
+        # The result is shared by every job attached to this task
+        job_ids = self.thread_pool.detach_jobs(key)
+        profiler.run(profiled, self.write_results, job_ids, result)
+        self.thread_pool.finish_jobs(job_ids, 'completed')
+        self.thread_pool.logger.info("Task %d has been processed.", task['job_id'],
+                                     extra={'job_id': task['job_id']})
+
+        finished_at = time.monotonic()
+        metrics.observe('task_result_write_seconds', labels, finished_at - computed_at)
+        metrics.observe('task_latency_seconds', labels, finished_at - task['enqueued_at'])
+        metrics.increment('tasks_completed_total', labels)
+
+    def compute(self, task, key, use_cache=True):
+        '''
+            Function that returns the result of a task, from the result cache
+            or computed by the selected backend.
+        '''
+        # The whole task is computed from the version of the dataset current now
+        dataset = self.thread_pool.data_ingestor.dataset
+        cache = self.thread_pool.result_cache
+
+        result = cache.get(key, dataset.version) if use_cache else None
+        if result is None:
+            if self.thread_pool.process_backend is not None:
+                result = self.thread_pool.process_backend.compute_result(task, dataset)
+            else:
+                processor = TaskProcessor(dataset)
+                result = processor.compute_result(task)
+            cache.put(key, result, dataset.version)
+        return result
 
-    def write_result(self, job_id, result):
+    def write_results(self, job_ids, result):
         '''
-            Function that writes the result of a task to a JSON file.
+            Function that saves the result of a task for every job attached to it.
         '''
-        os.makedirs('./results', exist_ok=True)
-        with open(f"./results/result-{job_id}.json", 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=4)
+        # Encoded once, whatever the number of jobs attached to the task
+        result_store = self.thread_pool.result_store
+        payload = result_store.encode(result)
+        for job_id in job_ids:
+            result_store.write(job_id, payload)
 
 class TaskProcessor:
     '''
         Class that processes the tasks based on the job type.
+        Every job type is answered from the aggregates precomputed by the DataIngestor.
     '''
     def __init__(self, data_ingestor):
         '''
-            Function to initialize the TaskProcessor with the data ingestor
+            Function to initialize the TaskProcessor with the data ingestor,
+            or directly with one version of its dataset
         '''
-        self.data = data_ingestor.data
-        self.questions_best_is_min = data_ingestor.questions_best_is_min
+        # Data and aggregates are read from a single version of the dataset
+        dataset = getattr(data_ingestor, 'dataset', data_ingestor)
+        self.data = dataset.data
+        self.aggregates = dataset.aggregates
+        self.questions_best_is_min = dataset.questions_best_is_min
 
     def compute_result(self, task):
         '''
             Function that calculates the result of the job based on the job type
         '''
-        job_type = task['job_type']
-        if job_type == 1:
-            return self.states_mean(task)
-        if job_type == 2:
-            return self.state_mean(task)
-        if job_type == 3:
-            return self.best5(task)
-        if job_type == 4:
-            return self.worst5(task)
-        if job_type == 5:
-            return self.global_mean(task)
-        if job_type == 6:
-            return self.diff_from_mean(task)
-        if job_type == 7:
-            return self.state_diff_from_mean(task)
-        if job_type == 8:
-            return self.mean_by_category(task)
-        if job_type == 9:
-            return self.state_mean_by_category(task)
-        return {"error": "Invalid job type"}
+        # Every job type is computed by the method named after it
+        name = JOB_TYPE_NAMES.get(task['job_type'])
+        if name is None:
+            return {"error": "Invalid job type"}
+        return getattr(self, name)(task)
 
     def states_mean(self, task):
         '''
-            Groups the data by 'LocationDesc' and calculates the mean of 'Data_Value' for each group
-            'LocationDesc' is the state name, therefore the result is the mean value for each state
+            Returns the mean of 'Data_Value' for each state ('LocationDesc'),
+            sorted in ascending order of the mean
         '''
-        result = self.data[self.data['Question'] == task['question']].groupby(
-            'LocationDesc')['Data_Value'].mean().to_dict()
+        result = self.aggregates.state_means(task['question'])
         return dict(sorted(result.items(), key=lambda item: item[1]))
 
     def state_mean(self, task):
         '''
-            Filters the data for the state & question and calculates the mean of 'Data_Value'
+            Returns the mean of 'Data_Value' for the state & question
         '''
-        result = self.data[(self.data['LocationDesc'] == task['state']) &
-                           (self.data['Question'] == task['question'])]['Data_Value'].mean()
-        return {task['state']: result}
+        return {task['state']: self.aggregates.state_mean(task['question'], task['state'])}
 
     def best5(self, task):
         '''
-            Calculates the mean of 'Data_Value' for each state for the specified question
-            Sorts the results based on whether a lower value is better or not
-            Returns the top 5 states
+            Returns the top 5 states, alias of best_k with k = 5 and no stratification
         '''
-        best_is_min = task['question'] in self.questions_best_is_min
-        result = self.data[self.data['Question'] == task['question']].groupby(
-            'LocationDesc')['Data_Value'].mean().to_dict()
-        sorted_result = dict(
-            sorted(result.items(), key=lambda item: item[1], reverse=not best_is_min))
-        return dict(list(sorted_result.items())[:5])
+        return self.top_k(task['question'], 5, True)
 
     def worst5(self, task):
         '''
-            Calculates the mean of 'Data_Value' for each state for the specified question
-            Sorts the results based on whether a lower value is better or not
-            Returns the last 5 states
+            Returns the last 5 states, alias of worst_k with k = 5 and no stratification
+        '''
+        return self.top_k(task['question'], 5, False)
+
+    def best_k(self, task):
+        '''
+            Returns the k best states (5 by default), from the best one,
+            restricted to a stratification if one is requested
+        '''
+        return self.top_k(task['question'], task.get('k', 5), True,
+                          task.get('stratification_category'), task.get('stratification'))
+
+    def worst_k(self, task):
         '''
-        best_is_min = task['question'] in self.questions_best_is_min
-        result = self.data[self.data['Question'] == task['question']].groupby(
-            'LocationDesc')['Data_Value'].mean().to_dict()
-        sorted_result = dict(
-            sorted(result.items(), key=lambda item: item[1], reverse=not best_is_min))
-        return dict(list(sorted_result.items())[-5:])
+            Returns the k worst states (5 by default), in the same order as best_k
+            (the worst one last), restricted to a stratification if one is requested
+        '''
+        return self.top_k(task['question'], task.get('k', 5), False,
+                          task.get('stratification_category'), task.get('stratification'))
+
+    def top_k(self, question, k, best, category=None, stratification=None): # pylint: disable=too-many-arguments
+        '''
+            Selects the k best or worst state means of a question, without sorting
+            all of them: the k states are picked with a partial selection and only
+            they are sorted. Whether a lower value is better depends on the question.
+        '''
+        if stratification is None:
+            means = self.aggregates.state_means(question)
+        else:
+            means = self.aggregates.stratification_state_means(question, category, stratification)
+        states = list(means)
+        values = np.fromiter(means.values(), dtype=float, count=len(states))
+        # Ranks from the best state to the worst one
+        if question not in self.questions_best_is_min:
+            values = -values
+
+        k = min(k, len(states))
+        if k == 0:
+            return {}
+        if k == len(states):
+            selected = np.arange(k)
+        elif best:
+            selected = np.argpartition(values, k - 1)[:k]
+        else:
+            selected = np.argpartition(values, len(states) - k)[len(states) - k:]
+        # Orders the selected states by rank, the ties by state name
+        selected = selected[np.lexsort((selected, values[selected]))]
+        return {states[i]: means[states[i]] for i in selected}
+
+    def state_question_matrix(self, task):
+        '''
+            Returns the mean of 'Data_Value' for every state and question, as the
+            state labels, the question labels and the rows of values (null for
+            the empty cells). Without 'states' or 'questions', all the ones with
+            values are returned, ordered by name, otherwise the requested ones in
+            their order. The rows are summed in a single pass, or, when only the
+            aggregates are kept, taken from them.
+        '''
+        if self.data is not None:
+            states, questions, sums, counts = state_question_sums(self.data)
+        else:
+            states, questions, sums, counts = self.aggregates.state_question_sums()
+        # An empty last row and column, for the requested labels without values
+        sums = np.pad(sums, ((0, 1), (0, 1)))
+        counts = np.pad(counts, ((0, 1), (0, 1)))
+
+        states, rows = select_labels(states, counts.any(axis=1), task.get('states'))
+        questions, columns = select_labels(
+            questions, counts.any(axis=0), task.get('questions'))
+        cells = np.ix_(rows, columns)
+        counts = counts[cells]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = sums[cells] / counts
+        return {
+            "states": states,
+            "questions": questions,
+            "values": [[mean if count else None for mean, count in zip(*row)]
+                       for row in zip(means.tolist(), counts.tolist())]
+        }
 
     def global_mean(self, task):
         '''
-            Calculates the mean of 'Data_Value' for the specified question
+            Returns the mean of 'Data_Value' for the specified question
         '''
-        return {'global_mean':
-                self.data[self.data['Question'] == task['question']]['Data_Value'].mean()}
+        return {'global_mean': self.aggregates.question_mean(task['question'])}
 
     def diff_from_mean(self, task):
         '''
             Calculates the difference between the global mean and the mean of 'Data_Value' 
             for each state for the specified question
         '''
-        global_mean = self.global_mean(task).get('global_mean')
-        state_means = self.data[self.data['Question'] == task['question']].groupby(
-            'LocationDesc')['Data_Value'].mean().to_dict()
+        global_mean = self.aggregates.question_mean(task['question'])
+        state_means = self.aggregates.state_means(task['question'])
         return {state: global_mean - value for state, value in state_means.items()}
 
     def state_diff_from_mean(self, task):
@@ -210,30 +541,52 @@ class TaskProcessor:
             Calculates the difference between the global mean and the mean of 'Data_Value'
             for the specified state and question
         '''
-        global_mean = self.global_mean(task).get('global_mean')
-        state_data = self.data[(self.data['LocationDesc'] == task['state']) &
-                               (self.data['Question'] == task['question'])]['Data_Value'].mean()
-        return {task['state']: global_mean - state_data}
+        global_mean = self.aggregates.question_mean(task['question'])
+        state_mean = self.aggregates.state_mean(task['question'], task['state'])
+        return {task['state']: global_mean - state_mean}
 
     def mean_by_category(self, task):
         '''
-            Groups the data by 'LocationDesc', 'StratificationCategory1' and 'Stratification1'
-            (group by state and by the stratification categories, stratifications within that state)
-            Calculates the mean of 'Data_Value' for each group
+            Returns the mean of 'Data_Value' for each group of 'LocationDesc',
+            'StratificationCategory1' and 'Stratification1' (the stratifications within a state)
         '''
-        filtered_data = self.data[self.data['Question'] == task['question']]
-        mean_values = filtered_data.groupby(
-            ['LocationDesc', 'StratificationCategory1', 'Stratification1'])['Data_Value'].mean()
-        return {str(state): value for state, value in mean_values.to_dict().items()}
+        mean_values = self.aggregates.state_category_means(task['question'])
+        return {str(group): value for group, value in mean_values.items()}
 
     def state_mean_by_category(self, task):
         '''
-            Groups the data by 'StratificationCategory1' and 'Stratification1' and
-            calculates the mean of 'Data_Value' for the specified state and question
+            Returns the mean of 'Data_Value' for each group of 'StratificationCategory1'
+            and 'Stratification1' for the specified state and question
         '''
-        filtered_data = self.data[(self.data['LocationDesc'] == task['state']) &
-                                  (self.data['Question'] == task['question'])]
-        mean_values = filtered_data.groupby(
-            ['StratificationCategory1', 'Stratification1'])['Data_Value'].mean()
+        mean_values = self.aggregates.category_means(task['question'], task['state'])
         return {task['state']:
-                {str(state): value for state, value in mean_values.to_dict().items()}}
+                {str(group): value for group, value in mean_values.items()}}
+
+    def batch(self, task):
+        '''
+            Computes a list of queries together, returning their results in order.
+            The queries are grouped by question so the global mean and the state
+            means of every distinct question are looked up only once.
+        '''
+        queries = task['queries']
+        results = [None] * len(queries)
+
+        positions_by_question = {}
+        for position, query in enumerate(queries):
+            positions_by_question.setdefault(query.get('question'), []).append(position)
+
+        for question, positions in positions_by_question.items():
+            global_mean = self.aggregates.question_mean(question)
+            state_means = self.aggregates.state_means(question)
+            for position in positions:
+                query = queries[position]
+                if query['job_type'] == 2:
+                    results[position] = {
+                        query['state']: state_means.get(query['state'], float('nan'))}
+                elif query['job_type'] == 7:
+                    results[position] = {
+                        query['state']: global_mean - state_means.get(query['state'], float('nan'))}
+                else:
+                    results[position] = self.compute_result(query)
+
+        return results
@@ -0,0 +1,3 @@
+from app.asgi import application
+# Serve with an ASGI server, for example:
+#   uvicorn asgi_server:application --port 5000
@@ -0,0 +1,136 @@
+'''
+    Benchmark of the ASGI serving mode against the Flask development server.
+
+    Both servers are started from the repository root (they need the dataset CSV),
+    then the same number of concurrent clients submit jobs with ?wait=<ms>, so
+    every request stays open until its result is ready. The script reports, for
+    each server, the completed requests per second, the latency percentiles and
+    the failed requests.
+
+    Usage (uvicorn must be installed):
+        python benchmarks/asgi_vs_flask.py --clients 2000 --requests 10000
+    Raise the open files limit (ulimit -n) for tens of thousands of clients.
+'''
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUESTION = "Percent of adults who engage in no leisure-time physical activity"
+STATES = ["Ohio", "Iowa", "Utah", "Texas", "Maine", "Idaho", "Kansas", "Oregon"]
+
+SERVERS = {
+    "flask": ["flask", "run", "--with-threads", "--port", "{port}"],
+    "asgi": [sys.executable, "-m", "uvicorn", "asgi_server:application",
+             "--port", "{port}", "--log-level", "warning", "--backlog", "65535"],
+}
+
+async def http_request(port, method, path, body=None):
+    '''
+        Function that sends one HTTP/1.1 request on its own connection
+        and returns the status code of the response.
+    '''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+        f"Connection: close\r\n\r\n".encode('latin-1') + payload)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1])
+
+async def wait_until_up(port, timeout=120):
+    '''
+        Function that polls the server until it answers.
+    '''
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await http_request(port, 'GET', '/api/num_jobs')
+            return
+        except OSError:
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+async def run_load(port, clients, requests, wait_ms):
+    '''
+        Function that runs the requests with the given number of concurrent clients.
+    '''
+    latencies = []
+    failures = 0
+    counter = iter(range(requests))
+
+    async def client():
+        nonlocal failures
+        for i in counter:
+            body = {"question": QUESTION, "state": STATES[i % len(STATES)]}
+            start = time.perf_counter()
+            try:
+                status = await http_request(port, 'POST', f"/api/state_mean?wait={wait_ms}", body)
+            except OSError:
+                status = 0
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+    return {
+        "clients": clients,
+        "requests": requests,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_s": percentile(0.50),
+        "p95_s": percentile(0.95),
+        "p99_s": percentile(0.99),
+        "failures": failures,
+    }
+
+def benchmark(name, port, args):
+    '''
+        Function that starts one server, loads it and stops it.
+    '''
+    command = [part.format(port=port) for part in SERVERS[name]]
+    server = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_until_up(port))
+        return asyncio.run(run_load(port, args.clients, args.requests, args.wait_ms))
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def main():
+    '''
+        Function that runs the benchmark for the selected servers.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--wait-ms", type=int, default=5000)
+    parser.add_argument("--servers", default="flask,asgi")
+    parser.add_argument("--port", type=int, default=5100)
+    args = parser.parse_args()
+
+    results = {}
+    for offset, name in enumerate(args.servers.split(',')):
+        results[name] = benchmark(name, args.port + offset, args)
+        print(name, json.dumps(results[name]), flush=True)
+
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+'''
+    Load test of a running server, replaying the tests/*/input/*.json corpus.
+
+    Every request submits a job to the endpoint of its test directory, then waits
+    for the result with /api/get_results/<job_id>?wait=<ms>, so the measured latency
+    covers the whole round trip. The requests are sent either as fast as the
+    clients allow (closed loop), or at a fixed arrival rate (--rate, open loop),
+    with at most --concurrency requests in flight. The script reports the
+    throughput, the p50/p95/p99 latency per endpoint and the error and 429 rates,
+    and writes them as JSON to compare runs (backends, thread counts...).
+
+    Additional requests can be replayed from a JSON lines file, one
+    {"endpoint": "state_mean", "body": {"question": ..., "state": ...}} per line.
+
+    Usage, with the server started (make run_server):
+        python benchmarks/load_test.py --requests 5000 --concurrency 32 --output run.json
+        python benchmarks/load_test.py --rate 200 --label backend=process
+'''
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_corpus(requests_file=None):
+    '''
+        Function that returns the (endpoint, body) pairs to replay.
+    '''
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'tests', '*', 'input', '*.json'))):
+        endpoint = path.split(os.sep)[-3]
+        with open(path, 'r', encoding='utf-8') as file:
+            corpus.append((endpoint, json.load(file)))
+
+    if requests_file:
+        with open(requests_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    request = json.loads(line)
+                    corpus.append((request['endpoint'], request['body']))
+    return corpus
+
+async def http_request(host, port, method, path, body=None):
+    '''
+        Function that sends one HTTP/1.1 request on its own connection
+        and returns the status code and the decoded JSON body of the response.
+    '''
+    reader, writer = await asyncio.open_connection(host, port)
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+        f"Connection: close\r\n\r\n".encode('latin-1') + payload)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    try:
+        data = json.loads(content)
+    except ValueError:
+        data = None
+    return int(head.split(b' ', 2)[1]), data
+
+async def round_trip(args, endpoint, body):
+    '''
+        Function that submits a job and waits for its result.
+        Returns the status code of the failing step, or 200.
+    '''
+    status, data = await http_request(args.host, args.port, 'POST', f"/api/{endpoint}", body)
+    if status != 200:
+        return status
+    job_id = data['job_id']
+
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        status, data = await http_request(
+            args.host, args.port, 'GET', f"/api/get_results/{job_id}?wait={args.wait_ms}")
+        if status != 200:
+            return status
+        if data.get('status') == 'done':
+            return 200
+    return 0
+
+def percentile(latencies, p):
+    '''
+        Function that returns the p percentile of sorted latencies.
+    '''
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+def summarize(samples, elapsed):
+    '''
+        Function that summarizes a list of (status, latency) samples.
+    '''
+    latencies = sorted(latency for status, latency in samples if status == 200)
+    total = len(samples)
+    rejected = sum(1 for status, _ in samples if status == 429)
+    errors = total - len(latencies) - rejected
+    return {
+        "requests": total,
+        "completed": len(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_s": percentile(latencies, 0.50),
+        "p95_s": percentile(latencies, 0.95),
+        "p99_s": percentile(latencies, 0.99),
+        "error_rate": errors / total if total else 0.0,
+        "rejected_429_rate": rejected / total if total else 0.0,
+    }
+
+async def run_load(args, corpus):
+    '''
+        Function that replays the corpus and returns the samples per endpoint.
+    '''
+    samples = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send(i):
+        endpoint, body = corpus[i % len(corpus)]
+        start = time.perf_counter()
+        try:
+            status = await round_trip(args, endpoint, body)
+        except (OSError, ValueError, KeyError, IndexError):
+            status = 0
+        finally:
+            semaphore.release()
+        samples.setdefault(endpoint, []).append((status, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    pending = []
+    for i in range(args.requests):
+        if args.rate > 0:
+            # Open loop: the arrivals don't slow down when the server does
+            delay = start + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await semaphore.acquire()
+        pending.append(asyncio.create_task(send(i)))
+    await asyncio.gather(*pending)
+    return samples, time.perf_counter() - start
+
+def main():
+    '''
+        Function that runs the load test and writes its report.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=0,
+                        help="arrivals per second, 0 sends as fast as the clients allow")
+    parser.add_argument("--wait-ms", type=int, default=5000)
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds before a job is counted as an error")
+    parser.add_argument("--requests-file", help="JSON lines file of additional requests")
+    parser.add_argument("--label", action="append", default=[],
+                        help="key=value recorded in the report, e.g. backend=process")
+    parser.add_argument("--output", help="file to write the JSON report to")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.requests_file)
+    samples, elapsed = asyncio.run(run_load(args, corpus))
+
+    report = {
+        "labels": dict(label.split('=', 1) for label in args.label),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "corpus_size": len(corpus),
+        },
+        "elapsed_s": elapsed,
+        "total": summarize([sample for endpoint_samples in samples.values()
+                            for sample in endpoint_samples], elapsed),
+        "endpoints": {endpoint: summarize(endpoint_samples, elapsed)
+                      for endpoint, endpoint_samples in sorted(samples.items())},
+    }
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+'''
+    Generator of larger datasets, statistically similar to the source CSV, and
+    benchmark of the server's scaling with the size of the data.
+
+    A dataset at N x scale holds N copies of the source rows, each one shifted to
+    a later range of years. The first copy is the source itself, and in the other
+    ones every Data_Value is drawn from a normal distribution with the mean and
+    standard deviation of its (question, state, category, stratification) group,
+    clipped to the range of its question. Missing values stay missing, so the
+    vocabulary and the proportions of the groups are the same at any scale.
+    The output only depends on the source and the seed.
+
+    Usage:
+        python benchmarks/scale_dataset.py --scale 10 --output data/scaled-10.csv
+        python benchmarks/scale_dataset.py --benchmark --scales 1,4,16 --workdir /tmp/scaling
+
+    The benchmark generates every scale (once, in --workdir), then in a fresh
+    process per scale loads the application on it and measures the load time,
+    the peak RSS and the latency of every job type. The DI_* variables of the
+    environment apply (DI_SNAPSHOT defaults to 0, to measure the CSV load).
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET = "nutrition_activity_obesity_usa_subset.csv"
+GROUP_COLUMNS = ['Question', 'LocationDesc', 'StratificationCategory1', 'Stratification1']
+VALUE = 'Data_Value'
+SHIFTED_COLUMNS = ['Data_Value_Alt', 'Low_Confidence_Limit', 'High_Confidence_Limit ']
+
+def generate(source_path, output_path, scale, seed=0):
+    '''
+        Function that writes the source dataset at the given scale.
+        Returns the number of rows written.
+    '''
+    # Read every column as text, so the copied columns are written back verbatim
+    source = pd.read_csv(source_path, dtype=str, keep_default_na=False)
+    values = pd.to_numeric(source[VALUE], errors='coerce')
+    keys = [source[column] for column in GROUP_COLUMNS]
+
+    means = values.groupby(keys).transform('mean').to_numpy()
+    # Groups of a single value get the spread of their question
+    question_std = values.groupby(source['Question']).transform('std').fillna(0.0)
+    stds = values.groupby(keys).transform('std').fillna(question_std).to_numpy()
+    lows = values.groupby(source['Question']).transform('min').to_numpy()
+    highs = values.groupby(source['Question']).transform('max').to_numpy()
+    missing = values.isna().to_numpy()
+
+    year_start = source['YearStart'].astype(int)
+    year_end = source['YearEnd'].astype(int)
+    span = year_end.max() - year_start.min() + 1
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    source.to_csv(output_path, index=False)
+    for copy in range(1, scale):
+        rng = np.random.default_rng([seed, copy])
+        sampled = np.round(np.clip(rng.normal(means, stds), lows, highs), 1)
+        delta = sampled - values.to_numpy()
+
+        rows = source.copy()
+        rows['YearStart'] = (year_start + copy * span).astype(str)
+        rows['YearEnd'] = (year_end + copy * span).astype(str)
+        rows[VALUE] = np.where(missing, '', sampled.astype(str))
+        for column in SHIFTED_COLUMNS:
+            # The confidence interval moves along with the value
+            shifted = pd.to_numeric(rows[column], errors='coerce').to_numpy() + delta
+            rows[column] = np.where(np.isnan(shifted), rows[column],
+                                    np.round(np.maximum(shifted, 0.0), 1).astype(str))
+        rows.to_csv(output_path, mode='a', header=False, index=False)
+    return len(source) * scale
+
+def measure(repetitions):
+    '''
+        Function that loads the application on the dataset of the current
+        directory and returns its load time, peak RSS and job latencies.
+    '''
+    # Imported here, importing the application loads the dataset
+    import resource # pylint: disable=import-outside-toplevel
+    start = time.perf_counter()
+    from app import webserver # pylint: disable=import-outside-toplevel
+    from app.task_runner import JOB_TYPES, TaskProcessor # pylint: disable=import-outside-toplevel
+    load_time = time.perf_counter() - start
+
+    data_ingestor = webserver.data_ingestor
+    processor = TaskProcessor(data_ingestor)
+    questions = data_ingestor.questions_best_is_min + data_ingestor.questions_best_is_max
+    states = sorted(data_ingestor.aggregates.state_means(questions[0]))
+
+    latencies = {}
+    for name, job_type in JOB_TYPES.items():
+        samples = []
+        for i in range(repetitions):
+            task = {'job_type': job_type, 'question': questions[i % len(questions)],
+                    'state': states[i % len(states)]}
+            job_start = time.perf_counter()
+            processor.compute_result(task)
+            samples.append(time.perf_counter() - job_start)
+        samples.sort()
+        latencies[name] = {
+            "p50_ms": samples[len(samples) // 2] * 1000,
+            "p95_ms": samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000
+        }
+    webserver.tasks_runner.shutdown()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "load_s": load_time,
+        "peak_rss_bytes": peak if sys.platform == 'darwin' else peak * 1024,
+        "data_bytes": data_ingestor.memory_report['data_bytes'],
+        "latency": latencies
+    }
+
+def benchmark(args):
+    '''
+        Function that measures every scale in its own process.
+    '''
+    results = {}
+    for scale in (int(scale) for scale in args.scales.split(',')):
+        directory = os.path.join(args.workdir, f"scale-{scale}")
+        path = os.path.join(directory, DATASET)
+        if not os.path.exists(path):
+            rows = generate(args.source, path, scale, args.seed)
+        else:
+            with open(path, 'rb') as file:
+                rows = sum(1 for _ in file) - 1
+
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        env.setdefault('DI_SNAPSHOT', '0')
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--measure',
+             '--repetitions', str(args.repetitions)],
+            cwd=directory, env=env, capture_output=True, text=True, check=True).stdout
+        results[scale] = dict(rows=rows, **json.loads(output.splitlines()[-1]))
+        print(scale, json.dumps(results[scale]), flush=True)
+    return results
+
+def main():
+    '''
+        Function that generates a dataset or runs the benchmark.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=os.path.join(ROOT, DATASET))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--output", default=f"scaled-{DATASET}")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--scales", default="1,2,4,8")
+    parser.add_argument("--workdir", default="./scaling")
+    parser.add_argument("--repetitions", type=int, default=200)
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--report", help="file to write the JSON benchmark report to")
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.repetitions)))
+    elif args.benchmark:
+        results = benchmark(args)
+        print(json.dumps(results, indent=4))
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=4)
+    else:
+        rows = generate(args.source, args.output, args.scale, args.seed)
+        print(f"Wrote {rows} rows to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+    Micro-benchmark of the job submission pipeline.
+
+    Concurrent clients submit jobs through the Flask routes, in process (with the
+    test client, so no HTTP server is involved), and the script reports the
+    submissions per second for every number of clients. It also checks that
+    every submission got its own job_id.
+
+    Usage, from the repository root (the application loads the dataset CSV):
+        python benchmarks/submit_throughput.py --clients 1,8,64 --seconds 5
+'''
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import webserver # pylint: disable=wrong-import-position
+
+QUESTION = "Percent of adults who engage in no leisure-time physical activity"
+STATES = ["Ohio", "Iowa", "Utah", "Texas", "Maine", "Idaho", "Kansas", "Oregon"]
+
+def run_clients(clients, seconds):
+    '''
+        Function that submits jobs from the given number of threads for the given
+        duration. Returns the number of submissions and the job_ids received.
+    '''
+    job_ids = [[] for _ in range(clients)]
+    deadline = time.perf_counter() + seconds
+    barrier = threading.Barrier(clients)
+
+    def client(index):
+        test_client = webserver.test_client()
+        barrier.wait()
+        i = 0
+        while time.perf_counter() < deadline:
+            body = {"question": QUESTION, "state": STATES[(index + i) % len(STATES)]}
+            response = test_client.post('/api/state_mean', json=body)
+            job_ids[index].append(response.get_json().get('job_id'))
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [job_id for ids in job_ids for job_id in ids]
+
+def main():
+    '''
+        Function that runs the benchmark for every number of clients.
+    '''
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", default="1,8,64")
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for clients in (int(clients) for clients in args.clients.split(',')):
+        job_ids = run_clients(clients, args.seconds)
+        results[clients] = {
+            "submissions": len(job_ids),
+            "submissions_per_s": len(job_ids) / args.seconds,
+            "duplicate_job_ids": len(job_ids) - len(set(job_ids)),
+        }
+        print(clients, json.dumps(results[clients]), flush=True)
+
+    webserver.tasks_runner.shutdown()
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
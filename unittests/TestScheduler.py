@@ -0,0 +1,141 @@
+'''
+    Module for testing the scheduler of the thread pool.
+'''
+import importlib.util
+import os
+import queue
+import unittest
+
+# Loaded from its file, importing the app package would start a whole server
+_SPEC = importlib.util.spec_from_file_location(
+    'scheduler', os.path.join(os.path.dirname(__file__), '..', 'app', 'scheduler.py'))
+scheduler = importlib.util.module_from_spec(_SPEC)
+_SPEC.loader.exec_module(scheduler)
+
+LIGHT_COST = 10
+HEAVY_COST = 1000
+
+class TestScheduler(unittest.TestCase):
+    '''
+        Class for testing the Scheduler, without the web server.
+    '''
+    def drain(self, tasks):
+        '''
+            Function that returns every queued task, in the order they are dequeued.
+        '''
+        order = []
+        while tasks.qsize():
+            order.append(tasks.get(timeout=0))
+        return order
+
+    def test_fifo(self):
+        '''
+            Test that tasks of the same lane and priority come out in arrival order.
+        '''
+        tasks = scheduler.Scheduler(LIGHT_COST)
+        for task in range(5):
+            tasks.put(task, 1)
+        self.assertEqual(self.drain(tasks), [0, 1, 2, 3, 4])
+
+    def test_priority(self):
+        '''
+            Test that tasks with a higher priority go first, the oldest ones first.
+        '''
+        tasks = scheduler.Scheduler(LIGHT_COST)
+        tasks.put("low", 1, priority=0)
+        tasks.put("high", 1, priority=2)
+        tasks.put("medium", 1, priority=1)
+        tasks.put("high again", 1, priority=2)
+        self.assertEqual(self.drain(tasks), ["high", "high again", "medium", "low"])
+
+    def test_lane_fairness(self):
+        '''
+            Test that a burst of heavy tasks doesn't starve the light ones
+            queued behind it.
+        '''
+        tasks = scheduler.Scheduler(LIGHT_COST)
+        for i in range(5):
+            tasks.put(f"heavy {i}", HEAVY_COST)
+        for i in range(5):
+            tasks.put(f"light {i}", 1)
+
+        order = self.drain(tasks)
+        self.assertEqual(len(order), 10)
+        # At most one heavy task runs before the light ones are all served
+        self.assertLessEqual(order.index("light 4"), 5)
+        self.assertEqual([task for task in order if task.startswith("light")],
+                         [f"light {i}" for i in range(5)])
+        self.assertEqual([task for task in order if task.startswith("heavy")],
+                         [f"heavy {i}" for i in range(5)])
+
+        stats = tasks.stats()
+        self.assertEqual(stats["light"]["dequeued"], 5)
+        self.assertEqual(stats["heavy"]["dequeued"], 5)
+        self.assertEqual(stats["heavy"]["queued"], 0)
+
+    def test_reject(self):
+        '''
+            Test that a full scheduler with the reject policy raises queue.Full
+            and keeps its queued tasks.
+        '''
+        tasks = scheduler.Scheduler(LIGHT_COST, max_depth=2, policy="reject")
+        self.assertIsNone(tasks.put("first", 1))
+        self.assertIsNone(tasks.put("second", HEAVY_COST))
+        with self.assertRaises(queue.Full):
+            tasks.put("third", 1, priority=5)
+        self.assertEqual(tasks.qsize(), 2)
+        self.assertEqual(sorted(self.drain(tasks)), ["first", "second"])
+
+    def test_shed_oldest(self):
+        '''
+            Test that a full scheduler with the shed_oldest policy sheds its oldest
+            task with the lowest priority, and never one above the new task's.
+        '''
+        tasks = scheduler.Scheduler(LIGHT_COST, max_depth=3, policy="shed_oldest")
+        tasks.put("kept", 1, priority=1)
+        tasks.put("oldest", 1)
+        tasks.put("newer", HEAVY_COST)
+
+        self.assertEqual(tasks.put("new", 1), "oldest")
+        self.assertEqual(tasks.qsize(), 3)
+        self.assertEqual(tasks.put("newest", HEAVY_COST), "newer")
+
+        # Every queued task has a priority above the new one's
+        tasks.put("important", 1, priority=2)
+        with self.assertRaises(queue.Full):
+            tasks.put("unimportant", 1, priority=-1)
+
+        # The shed tasks are skipped when their entries reach the top of the lanes
+        self.assertEqual(sorted(self.drain(tasks)), ["important", "kept", "newest"])
+        self.assertEqual(tasks.stats()["light"]["queued"], 0)
+
+    def test_shed_many(self):
+        '''
+            Test that shedding far more tasks than the scheduler holds leaves
+            only the last ones queued, in order.
+        '''
+        tasks = scheduler.Scheduler(LIGHT_COST, max_depth=10, policy="shed_oldest")
+        shed = [tasks.put(task, 1) for task in range(1000)]
+        self.assertEqual(shed, [None] * 10 + list(range(990)))
+        self.assertEqual(self.drain(tasks), list(range(990, 1000)))
+
+    def test_retry_after(self):
+        '''
+            Test that the Retry-After estimate stays between 1 and 60 seconds.
+        '''
+        tasks = scheduler.Scheduler(LIGHT_COST)
+        self.assertEqual(tasks.retry_after(), 1)
+        for task in range(1000):
+            tasks.put(task, 1)
+        for _ in range(100):
+            tasks.get(timeout=0)
+        self.assertGreaterEqual(tasks.retry_after(), 1)
+        self.assertLessEqual(tasks.retry_after(), 60)
+
+    def test_empty(self):
+        '''
+            Test that get raises queue.Empty once its timeout expires.
+        '''
+        tasks = scheduler.Scheduler(LIGHT_COST)
+        with self.assertRaises(queue.Empty):
+            tasks.get(timeout=0.01)
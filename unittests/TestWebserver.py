@@ -4,6 +4,7 @@
 import unittest
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
 class TestWebserver(unittest.TestCase):
@@ -101,6 +102,247 @@ class TestWebserver(unittest.TestCase):
         res_data = res.json()["data"]
         self.assertEqual(res_data, expected_res)
 
+    # The tests below submit more jobs, so they are named to run after
+    # test_z_get_jobs, which expects only the 9 jobs above, and before the shutdown
+
+    def test_z_get_jobs_pages(self):
+        '''
+            Test the jobs endpoint with ?start and ?limit, following next_start
+            through every page, and with ?status.
+        '''
+        for state in ("Ohio", "Iowa", "Utah"):
+            self.submit('state_mean', {
+                "question": "Percent of adults aged 18 years and older who have obesity",
+                "state": state
+            })
+        all_jobs = requests.get(self.base_url + 'jobs', timeout=5).json()["data"]
+
+        pages = []
+        start = 1
+        while start is not None:
+            res = requests.get(self.base_url + f'jobs?start={start}&limit=2', timeout=5)
+            res_data = res.json()
+            self.assertLessEqual(len(res_data["data"]), 2)
+            pages.extend(res_data["data"])
+            start = res_data["next_start"]
+        self.assertEqual(pages, all_jobs)
+
+        done = requests.get(self.base_url + 'jobs?status=done', timeout=5).json()["data"]
+        self.assertEqual(done, [job for job in all_jobs if list(job.values()) == ["done"]])
+        failed = requests.get(self.base_url + 'jobs?status=failed', timeout=5).json()["data"]
+        self.assertEqual(failed, [])
+
+    def test_z_get_results_batch(self):
+        '''
+            Test the batch endpoint: the results come back in the order of the queries.
+        '''
+        question = "Percent of adults aged 18 years and older who have obesity"
+        results = self.submit('batch', {"queries": [
+            {"job_type": "state_mean", "question": question, "state": "Ohio"},
+            {"job_type": "global_mean", "question": question},
+            {"job_type": "state_mean", "question": question, "state": "Iowa"}
+        ]})
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0], self.submit('state_mean', {
+            "question": question, "state": "Ohio"}))
+        self.assertEqual(results[1], self.submit('global_mean', {"question": question}))
+        self.assertEqual(results[2], self.submit('state_mean', {
+            "question": question, "state": "Iowa"}))
+
+    def test_z_get_results_best_k(self):
+        '''
+            Test the best_k and worst_k endpoints: with k = 5 they match best5 and
+            worst5, and a stratification restricts them to its state means.
+        '''
+        question = "Percent of adults aged 18 years and older who have obesity"
+        self.assertEqual(self.submit('best_k', {"question": question, "k": 5}),
+                         self.submit('best5', {"question": question}))
+        self.assertEqual(self.submit('worst_k', {"question": question, "k": 5}),
+                         self.submit('worst5', {"question": question}))
+
+        group = "('Age (years)', '18 - 24')"
+        best = self.submit('best_k', {
+            "question": question, "k": 3,
+            "stratification_category": "Age (years)", "stratification": "18 - 24"
+        })
+        self.assertEqual(len(best), 3)
+        self.assertEqual(list(best.values()), sorted(best.values()))
+        for state, value in best.items():
+            by_category = self.submit('state_mean_by_category', {
+                "question": question, "state": state})
+            self.assertAlmostEqual(value, by_category[state][group])
+
+    def test_z_get_results_cached(self):
+        '''
+            Test the cache_stats endpoint: the second of two identical requests
+            is answered from the cache.
+        '''
+        payload = {"question": "Percent of adults who engage in no leisure-time physical activity"}
+        before = requests.get(self.base_url + 'cache_stats', timeout=5).json()["data"]
+
+        first = self.submit('global_mean', payload)
+        second = self.submit('global_mean', payload)
+        after = requests.get(self.base_url + 'cache_stats', timeout=5).json()["data"]
+
+        self.assertEqual(first, second)
+        self.assertGreaterEqual(after["hits"], before["hits"] + 1)
+        self.assertGreaterEqual(after["hits"] + after["misses"],
+                                before["hits"] + before["misses"] + 2)
+        self.assertIn("evictions", after)
+
+    def test_z_get_results_coalesced(self):
+        '''
+            Test that identical jobs submitted together attach to one task:
+            every job resolves to the same result, computed fewer times.
+        '''
+        payload = {"question": "Percent of adults aged 18 years and older who have obesity"}
+        before = self.tasks_completed()
+
+        with ThreadPoolExecutor(16) as executor:
+            responses = list(executor.map(
+                lambda _: requests.post(self.base_url + 'mean_by_category', json=payload,
+                                        timeout=5).json(),
+                range(16)))
+        job_ids = [res["job_id"] for res in responses]
+        self.assertEqual(len(set(job_ids)), 16)
+
+        results = [self.get_result(job_id) for job_id in job_ids]
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+        self.assertLess(self.tasks_completed() - before, 16)
+
+    def test_z_get_results_wait(self):
+        '''
+            Test the get_results endpoint with ?wait, which answers once the job is done.
+        '''
+        res = requests.post(self.base_url + 'global_mean', json={
+            "question": "Percent of adults aged 18 years and older who have obesity"
+        }, timeout=5)
+        job_id = res.json()["job_id"]
+
+        res = requests.get(
+            self.base_url + "get_results/" + str(job_id) + "?wait=5000", timeout=10)
+        res_data = res.json()
+        self.assertEqual(res_data["status"], "done")
+        self.assertIn("global_mean", res_data["data"])
+
+    def test_z_get_results_inline(self):
+        '''
+            Test a job endpoint with ?wait, which returns the result inline
+            when the job finishes in time.
+        '''
+        payload = {"question": "Percent of adults who engage in no leisure-time physical activity",
+                   "state": "Ohio"}
+        res = requests.post(self.base_url + 'state_mean?wait=5000', json=payload, timeout=10)
+        res_data = res.json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res_data["status"], "done")
+        self.assertEqual(res_data["data"], self.get_result(res_data["job_id"]))
+        self.assertEqual(res_data["data"], self.submit('state_mean', payload))
+
+        # Without ?wait only the job_id is returned
+        res_data = requests.post(self.base_url + 'state_mean', json=payload, timeout=5).json()
+        self.assertNotIn("data", res_data)
+        self.assertIn("job_id", res_data)
+
+    def test_z_get_results_invalid(self):
+        '''
+            Test that the job endpoints answer 400 to a request without its
+            question or state, before allocating it a job_id.
+        '''
+        question = "Percent of adults aged 18 years and older who have obesity"
+        first = requests.post(self.base_url + 'global_mean', json={"question": question},
+                              timeout=5).json()["job_id"]
+
+        for route, payload in (('states_mean', {}),
+                               ('global_mean', {"state": "Ohio"}),
+                               ('global_mean', {"question": 42}),
+                               ('state_mean', {"question": question}),
+                               ('state_mean_by_category', {"question": question, "state": None}),
+                               ('state_mean', [question, "Ohio"])):
+            res = requests.post(self.base_url + route, json=payload, timeout=5)
+            self.assertEqual(res.status_code, 400, (route, payload))
+            self.assertEqual(res.json()["status"], "error")
+
+        res = requests.post(self.base_url + 'state_mean', data="question", timeout=5)
+        self.assertEqual(res.status_code, 400)
+
+        last = requests.post(self.base_url + 'global_mean', json={"question": question},
+                             timeout=5).json()["job_id"]
+        self.assertEqual(last, first + 1)
+
+    def test_z_get_results_matrix(self):
+        '''
+            Test the state_question_matrix endpoint: a cell matches state_mean,
+            and the unknown requested states and questions have null values.
+        '''
+        question = "Percent of adults aged 18 years and older who have obesity"
+        matrix = self.submit('state_question_matrix', {
+            "states": ["Ohio", "Atlantis"],
+            "questions": [question, "Unknown question"]
+        })
+        state_mean = self.submit('state_mean', {"question": question, "state": "Ohio"})
+
+        self.assertEqual(matrix["states"], ["Ohio", "Atlantis"])
+        self.assertEqual(matrix["questions"], [question, "Unknown question"])
+        self.assertAlmostEqual(matrix["values"][0][0], state_mean["Ohio"])
+        self.assertEqual(matrix["values"][0][1], None)
+        self.assertEqual(matrix["values"][1], [None, None])
+
+    def test_z_get_results_stream(self):
+        '''
+            Test the stream_results endpoint: one result event per job, then the end.
+        '''
+        job_ids = []
+        for route in ('global_mean', 'states_mean'):
+            res = requests.post(self.base_url + route, json={
+                "question": "Percent of adults aged 18 years and older who have obesity"
+            }, timeout=5)
+            job_ids.append(res.json()["job_id"])
+
+        res = requests.get(
+            self.base_url + "stream_results?timeout=5000&job_ids=" +
+            ",".join(str(job_id) for job_id in job_ids), timeout=10)
+        events = [event for event in res.text.split("\n\n") if event.startswith("event: result")]
+        results = [json.loads(event.split("data: ", 1)[1]) for event in events]
+
+        self.assertEqual(sorted(result["job_id"] for result in results), job_ids)
+        for result in results:
+            self.assertEqual(result["status"], "done")
+
+    def test_z_get_results_ingest(self):
+        '''
+            Test the ingest endpoint: every appended chunk publishes a new version
+            and moves the global mean of its question, a chunk without rows doesn't.
+        '''
+        question = "Percent of adults aged 18 years and older who have obesity"
+        header = "Question,LocationDesc,StratificationCategory1,Stratification1,Data_Value\n"
+        chunk = header + f'"{question}",Ohio,Total,Total,1000\n'
+        before = self.submit('global_mean', {"question": question})["global_mean"]
+
+        res = requests.post(self.base_url + 'ingest', data=chunk, timeout=5)
+        first = res.json()["data"]
+        after = self.submit('global_mean', {"question": question})["global_mean"]
+        self.assertEqual(first["rows"], 1)
+        self.assertGreater(after, before)
+
+        res = requests.post(self.base_url + 'ingest', data=chunk, timeout=5)
+        second = res.json()["data"]
+        self.assertEqual(second["version"], first["version"] + 1)
+        self.assertGreater(self.submit('global_mean', {"question": question})["global_mean"], after)
+
+        res = requests.post(self.base_url + 'ingest', data=header, timeout=5)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["data"], {"version": second["version"], "rows": 0})
+
+        # Rows without a stratification, whose categorical columns are all empty
+        res = requests.post(self.base_url + 'ingest',
+                            data=header + f'"{question}",Ohio,,,40\n', timeout=5)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["data"]["version"], second["version"] + 1)
+
     def run_test_case(self, test_number):
         '''
             Function that runs the test case for the given test number.
@@ -146,5 +388,34 @@ class TestWebserver(unittest.TestCase):
             expected_data = json.load(f)
             self.assertEqual(res_data, expected_data)
 
+    def submit(self, route, payload):
+        '''
+            Function that submits a job to the given endpoint and returns its result.
+        '''
+        res = requests.post(self.base_url + route, json=payload, timeout=5)
+        return self.get_result(res.json()["job_id"])
+
+    def get_result(self, job_id):
+        '''
+            Function that polls the result of a job until it is done.
+        '''
+        for _ in range(50):
+            res = requests.get(self.base_url + "get_results/" + str(job_id), timeout=5)
+            res_data = res.json()
+            if res_data["status"] == "done":
+                return res_data["data"]
+            time.sleep(0.1)
+
+        self.fail("Timeout")
+        return None
+
+    def tasks_completed(self):
+        '''
+            Function that returns the number of tasks completed by the server.
+        '''
+        res = requests.get(self.base_url + 'metrics', timeout=5)
+        return sum(float(line.split()[-1]) for line in res.text.splitlines()
+                   if line.startswith('tasks_completed_total'))
+
 if __name__ == '__main__':
     unittest.main()